@@ -0,0 +1,263 @@
+#!/usr/bin/python
+
+import json
+import numpy as np
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import data
+import loader
+
+# Statistics that are fed chunk by chunk, in constant memory, and that can be
+# merged: the chunks of one run, the worker processes of a batch, or runs
+# recorded months apart (save() them, load() and merge() later).
+#
+#   Covariance   means and co-moments (Welford, Chan et al. for whole chunks)
+#   Histogram2d  fixed bins, the same for every run, so the counts just add up
+#   Drift        running sum of a difference, e.g. estimated - measured period,
+#                optionally weighted (a grid step stands for that many samples)
+#
+# Every one takes chunks as {key: np.ndarray}, like loader.readChunks yields them.
+
+CHUNK_ROWS = loader.DEFAULT_CHUNK_ROWS
+
+# Fixed ranges (raw units), so that histograms of different runs can be merged:
+# the BME280's range, and expectedMinCount..expectedMaxCount from config.hpp
+EXPECTED_DEVIATION = .1     # same as in config.hpp
+NOMINAL_PERIOD = 1000000    # periodsPerMeasurement = expectedOscFreq: one second
+TEMPERATURE_RANGE = (-4000, 8500)
+PERIOD_RANGE = (NOMINAL_PERIOD / (1 + EXPECTED_DEVIATION), NOMINAL_PERIOD / (1 - EXPECTED_DEVIATION))
+BINS_PER_UNIT = 2   # per degree and us (normalized), like figures.getNormalizedRangeAndBin
+
+
+class Covariance:
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.count = 0
+        self.mean = np.zeros(len(self.keys))
+        self.comoment = np.zeros((len(self.keys), len(self.keys)))
+
+    def addMany(self, columns):
+        table = np.column_stack([np.asarray(columns[key], dtype=np.float64) for key in self.keys])
+        if len(table) == 0:
+            return
+        # the chunk on its own (centered, so no big numbers cancel), then merged
+        chunk = Covariance(self.keys)
+        chunk.count = len(table)
+        chunk.mean = table.mean(axis=0)
+        centered = table - chunk.mean
+        chunk.comoment = centered.T @ centered
+        self.merge(chunk)
+
+    def merge(self, other):
+        assert self.keys == other.keys
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.comoment = self.comoment + other.comoment + np.outer(delta, delta) * (self.count * other.count / count)
+        self.mean = self.mean + delta * (other.count / count)
+        self.count = count
+
+    def covariance(self, ddof = 1):
+        # ddof 1 like np.cov
+        return self.comoment / (self.count - ddof)
+
+    def std(self, key, ddof = 0):
+        # ddof 0 like np.std
+        i = self.keys.index(key)
+        return np.sqrt(self.comoment[i, i] / (self.count - ddof))
+
+    def toDict(self):
+        return {'keys': self.keys, 'count': self.count, 'mean': self.mean.tolist(), 'comoment': self.comoment.tolist()}
+
+    @classmethod
+    def fromDict(cls, d):
+        ret = cls(d['keys'])
+        ret.count = d['count']
+        ret.mean = np.array(d['mean'])
+        ret.comoment = np.array(d['comoment'])
+        return ret
+
+
+class Histogram2d:
+    # Samples outside of the ranges are only counted
+    def __init__(self, keys = ('temperature', 'period'), ranges = (TEMPERATURE_RANGE, PERIOD_RANGE), bins = None):
+        self.keys = list(keys)
+        self.ranges = [tuple(r) for r in ranges]
+        if bins is None:
+            bins = [int(round((hi - lo) / data.TABLE_FORMAT[key].denormalize(1 / BINS_PER_UNIT)))
+                    for key, (lo, hi) in zip(self.keys, self.ranges)]
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.outside = 0
+
+    def _index(self, values, axis):
+        lo, hi = self.ranges[axis]
+        return np.floor((np.asarray(values, dtype=np.float64) - lo) * (self.counts.shape[axis] / (hi - lo)))
+
+    def addMany(self, columns):
+        x, y = self._index(columns[self.keys[0]], 0), self._index(columns[self.keys[1]], 1)
+        inside = (x >= 0) & (x < self.counts.shape[0]) & (y >= 0) & (y < self.counts.shape[1])
+        flat = x[inside].astype(np.int64) * self.counts.shape[1] + y[inside].astype(np.int64)
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+        self.outside += int(len(inside) - inside.sum())
+
+    def merge(self, other):
+        assert (self.keys, self.ranges, self.counts.shape) == (other.keys, other.ranges, other.counts.shape)
+        self.counts += other.counts
+        self.outside += other.outside
+
+    @property
+    def count(self):
+        return int(self.counts.sum()) + self.outside
+
+    def edges(self, axis):
+        return np.linspace(*self.ranges[axis], self.counts.shape[axis] + 1)
+
+    def occupied(self):
+        # (x edges, y edges, counts) of the bins that are not empty, and around them
+        xs, ys = np.nonzero(self.counts)
+        if not len(xs):
+            return self.edges(0)[:1], self.edges(1)[:1], self.counts[:0, :0]
+        x, y = slice(xs.min(), xs.max() + 1), slice(ys.min(), ys.max() + 1)
+        return (self.edges(0)[x.start:x.stop + 1], self.edges(1)[y.start:y.stop + 1], self.counts[x, y])
+
+    def toDict(self):
+        # sparse, most bins never see a sample
+        flat = np.flatnonzero(self.counts)
+        return {'keys': self.keys, 'ranges': self.ranges, 'bins': list(self.counts.shape), 'outside': self.outside,
+                'index': flat.tolist(), 'counts': self.counts.flat[flat].tolist()}
+
+    @classmethod
+    def fromDict(cls, d):
+        ret = cls(d['keys'], d['ranges'], d['bins'])
+        ret.counts.flat[d['index']] = d['counts']
+        ret.outside = d['outside']
+        return ret
+
+
+class Drift:
+    # In order: merging appends the other one's samples after ours
+    def __init__(self, key = 'difference', weight_key = None):
+        self.key = key
+        self.weight_key = weight_key
+        self.count = 0
+        self.total = 0.0
+        self.lowest = 0.0   # of the running sum
+        self.highest = 0.0
+
+    def addMany(self, columns):
+        values = np.asarray(columns[self.key], dtype=np.float64)
+        if self.weight_key is not None:
+            values = values * columns[self.weight_key]
+        running = np.cumsum(values)
+        if len(running) == 0:
+            return
+        self.lowest = min(self.lowest, self.total + running.min())
+        self.highest = max(self.highest, self.total + running.max())
+        self.total += running[-1]
+        self.count += len(running)
+
+    def merge(self, other):
+        assert (self.key, self.weight_key) == (other.key, other.weight_key)
+        self.lowest = min(self.lowest, self.total + other.lowest)
+        self.highest = max(self.highest, self.total + other.highest)
+        self.total += other.total
+        self.count += other.count
+
+    def seconds(self, avg_duration_of_sample_us):
+        # like pipeline.Stats.drift_s. Weighted: the duration per unit of weight
+        return self.total * avg_duration_of_sample_us / 1000000
+
+    def toDict(self):
+        return {'key': self.key, 'weight_key': self.weight_key, 'count': self.count, 'total': self.total, 'lowest': self.lowest, 'highest': self.highest}
+
+    @classmethod
+    def fromDict(cls, d):
+        ret = cls(d['key'], d.get('weight_key'))
+        ret.count, ret.total, ret.lowest, ret.highest = d['count'], d['total'], d['lowest'], d['highest']
+        return ret
+
+
+KINDS = {'covariance': Covariance, 'histogram2d': Histogram2d, 'drift': Drift}
+
+def feed(accumulator, columns, chunk_rows = CHUNK_ROWS):
+    # whole columns that are already in memory, chunk by chunk anyway: no temporaries of their size
+    num_rows = len(next(iter(columns.values()))) if columns else 0
+    for offset in range(0, num_rows, chunk_rows):
+        accumulator.addMany({key: values[offset:offset + chunk_rows] for key, values in columns.items()})
+    return accumulator
+
+def mergeAll(parts):
+    # [{name: accumulator}] -> {name: accumulator}, in that order (matters for Drift)
+    ret = {}
+    for part in parts:
+        for name, accumulator in part.items():
+            if name in ret:
+                ret[name].merge(accumulator)
+            else:
+                ret[name] = accumulator
+    return ret
+
+def save(accumulators, filename):
+    kinds = {cls: kind for kind, cls in KINDS.items()}
+    with open(filename, 'w') as f:
+        json.dump({name: {'kind': kinds[type(a)], **a.toDict()} for name, a in accumulators.items()}, f)
+
+def load(filename):
+    with open(filename) as f:
+        return {name: KINDS[d['kind']].fromDict(d) for name, d in json.load(f).items()}
+
+
+def summarize(filename, chunk_rows = CHUNK_ROWS):
+    # One pass over a database, never more than a chunk of it in memory. Drift of
+    # the firmware's own estimate, that's what the clock actually did.
+    accumulators = {
+        'covariance': Covariance(['period', 'temperature']),
+        'histogram': Histogram2d(),
+        'drift': Drift(),
+    }
+    for chunk in loader.readChunks(filename, ['period', 'temperature', 'period_estimate'],
+                                   filters=loader.PLAUSIBILITY_FILTERS, normalize=False, chunk_rows=chunk_rows):
+        chunk['difference'] = chunk['period_estimate'] - chunk['period']
+        for accumulator in accumulators.values():
+            accumulator.addMany(chunk)
+    return accumulators
+
+def describe(accumulators) -> str:
+    moments, drift, histogram = accumulators['covariance'], accumulators['drift'], accumulators['histogram']
+    if moments.count < 2:
+        return f"{moments.count} samples, not enough for anything"
+    period = data.TABLE_FORMAT['period']
+    avg_period = moments.mean[moments.keys.index('period')]
+    return "\n".join([
+        f"{moments.count} samples, means: " + ", ".join(f"{k} {m}" for k, m in zip(moments.keys, moments.mean)),
+        f"Covariance ({', '.join(moments.keys)}):",
+        str(moments.covariance()),
+        f"Standard deviation of the period: {period.normalize(moments.std('period'))} us "
+        f"-> {moments.std('period') * 24 * 60 * 60 / avg_period} s / day",
+        f"Drift of the firmware's estimate: {drift.seconds(avg_period)} seconds "
+        f"(running sum between {drift.lowest} and {drift.highest})",
+        f"Histogram: {np.count_nonzero(histogram.counts)} bins used, {histogram.outside} samples outside",
+    ])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='aggregate.py',
+                description='Covariance, temperature/period histogram and drift of sensor log databases, in one streaming pass')
+    parser.add_argument('database', nargs='*')
+    parser.add_argument('--merge', nargs='+', default=[], help='Add these saved statistics (JSON, see --output)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes, one database each')
+    parser.add_argument('--output', default=None, help='Save the merged statistics there (JSON)')
+    args = parser.parse_args()
+    if not args.database and not args.merge:
+        parser.error("nothing to do")
+
+    with ProcessPoolExecutor(args.workers) as executor:
+        parts = [load(filename) for filename in args.merge] + list(executor.map(summarize, args.database))
+    accumulators = mergeAll(parts)
+    print (describe(accumulators))
+    if args.output:
+        save(accumulators, args.output)
+        print (f"Statistics in {args.output}")
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+import json
+import os
+import numpy as np
+from argparse import ArgumentParser
+
+import data
+import loader
+
+# Columnar archive of a recorded run: one .npy per column (raw, fixed width,
+# dtype from TABLE_FORMAT) plus a small meta.json. Opened via np.memmap, so
+# "loading" a multi-GB run is just mapping a few files.
+#
+#   2024-01-01_12-00-00_sensor_log.db
+#   2024-01-01_12-00-00_sensor_log.archive/
+#       meta.json
+#       period.npy, temperature.npy, ...
+
+META_FILE = 'meta.json'
+FORMAT_VERSION = 3      # 2: data.TIME_COLUMNS, if the database has them. 3: ColDesc.storage dtypes
+
+def archivePath(db_filename):
+    return os.path.splitext(db_filename)[0] + '.archive'
+
+def sourceFingerprint(db_filename):
+    # rows can still be in the WAL, so that counts as well
+    fingerprint = {}
+    for suffix in ('', '-wal'):
+        path = db_filename + suffix
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint[suffix or 'db'] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
+
+def readMeta(path):
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def isFresh(db_filename, path = None):
+    meta = readMeta(path or archivePath(db_filename))
+    return (meta is not None
+            and meta.get('version') == FORMAT_VERSION
+            and meta.get('source') == sourceFingerprint(db_filename))
+
+def export(db_filename, path = None, chunk_rows = loader.DEFAULT_CHUNK_ROWS):
+    path = path or archivePath(db_filename)
+    os.makedirs(path, exist_ok=True)
+    fingerprint = sourceFingerprint(db_filename)
+    num_rows = loader.countRows(db_filename)
+    keys = list(data.TABLE_FORMAT.keys())
+    if loader.hasColumns(db_filename, data.TIME_COLUMNS):
+        keys += list(data.TIME_COLUMNS.keys())
+
+    columns = {}
+    for key in keys:
+        columns[key] = np.lib.format.open_memmap(os.path.join(path, f'{key}.npy'), mode='w+',
+                                                 dtype=loader.dtypeOf(data.COLUMNS[key]), shape=(num_rows,))
+    offset = 0
+    for chunk in loader.readChunks(db_filename, keys, normalize=False, chunk_rows=chunk_rows):
+        length = min(len(chunk['period']), num_rows - offset)
+        for key, column in columns.items():
+            column[offset:offset + length] = chunk[key][:length]
+        offset += length
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'rows': offset,
+        'expected_frequency': data.expected_frequency,
+        'source': fingerprint,
+        'columns': {key: {
+            'name': desc.name,
+            'dtype': loader.dtypeOf(desc).str,
+            'unit': desc.unit,
+            'fractional': desc.fractional,
+        } for key, desc in data.COLUMNS.items() if key in keys},
+    }
+    # meta last: an archive without meta is not an archive
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+def openArchive(path, keys = None):
+    # Raw columns, memory mapped (read only)
+    meta = readMeta(path)
+    keys = keys if keys is not None else meta['columns'].keys()
+    rows = meta['rows']
+    return {key: np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r')[:rows] for key in keys}
+
+def load(db_filename, keys = None, filters = None, normalize = True):
+    # Columns from the archive if it is up to date, otherwise from SQLite.
+    # Filters need to be loader.Above-style objects to work on the archive.
+    keys = list(keys) if keys is not None else list(data.TABLE_FORMAT.keys())
+    filters = filters or []
+    path = archivePath(db_filename)
+    needed = set(keys) | {f.key for f in filters}
+    if not isFresh(db_filename, path) or not needed <= set(readMeta(path)['columns']):
+        return loader.readColumns(db_filename, keys, filters, normalize)
+
+    mapped = openArchive(path, needed)
+    columns = {key: mapped[key] for key in keys}
+    if filters:
+        mask = np.logical_and.reduce([f.mask(mapped) for f in filters])
+        columns = {key: column[mask] for key, column in columns.items()}
+    if normalize:
+        columns = {key: data.COLUMNS[key].normalize(column) for key, column in columns.items()}
+    return columns
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='archive.py',
+                description='Converts sensor log databases into memory-mappable column archives')
+    parser.add_argument('database', nargs='+')
+    parser.add_argument('--force', action='store_true', help='Export even if the archive is up to date')
+    args = parser.parse_args()
+
+    for db_filename in args.database:
+        if not args.force and isFresh(db_filename):
+            print (f"{archivePath(db_filename)} is up to date")
+            continue
+        print (f"Exporting {db_filename} -> {export(db_filename)}")
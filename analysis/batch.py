@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+import glob
+import os
+import numpy as np
+import pandas as pd
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+
+import fitting
+import pipeline
+
+# estimate.py for a whole shelf of captures. One worker process per run (the
+# sweep inside runs inline then, no pools in pools), one summary row per run:
+#
+#   ./batch.py captures/ 'old/*_sensor_log.db' --pooled --output summary.csv
+
+RUN_PATTERN = '*_sensor_log.db'
+
+def findRuns(paths):
+    # directories, globs and plain files, in that order of magic
+    runs = []
+    for path in paths:
+        if os.path.isdir(path):
+            runs += sorted(glob.glob(os.path.join(path, RUN_PATTERN)))
+        else:
+            runs += sorted(glob.glob(path))
+    return list(dict.fromkeys(runs))    # no duplicates, but keep the order
+
+def calibrate(filename, sweep_steps = pipeline.SWEEP_STEPS, damp_factor = None, use_cache = True, engine = 'extrema',
+              resample_hz = None, fit_degree = pipeline.FIT_DEGREE):
+    run = pipeline.Run(filename, sweep_steps=sweep_steps, workers=1, damp_factor=damp_factor, use_cache=use_cache,
+                       engine=engine, resample_hz=resample_hz, fit_degree=fit_degree)
+    summary = {'database': filename}
+    try:
+        summary['samples'] = len(run.reference_time_us)
+        summary['duration_h'] = run.duration_us / 1000000 / 3600
+        summary['temp_mean'] = float(np.mean(run.temp))
+        summary['temp_min'] = float(np.min(run.temp))
+        summary['temp_max'] = float(np.max(run.temp))
+        summary['period_mean'] = float(np.mean(run.period))
+        summary['crossings'] = len(run.sweep.roots) if damp_factor is None else None
+        summary['damp_factor'] = run.damp_factor
+        summary['degree'] = run.degree
+        # lowest order first, like temperatureCalibrationPolynom in config.hpp
+        for i, c in enumerate(reversed(run.damped_fit.coefficients)):
+            summary[f'c{i}'] = c
+        summary['improvement'] = run.damped_stats.improvement_ratio
+        summary['drift_s'] = run.stats.drift_s
+        summary['damped_drift_s'] = run.damped_stats.drift_s
+        summary['error'] = None
+    except Exception as e:
+        # one bad capture should not cost us the other fifty
+        summary['error'] = f"{type(e).__name__}: {e}"
+    return summary
+
+def dampedSums(filename, damp_factor, degree, domain, resample_hz = None, use_cache = True):
+    # normal equation sums of one run (weighted like its own fit), to be merged into the pooled fit
+    run = pipeline.Run(filename, damp_factor=damp_factor, resample_hz=resample_hz, use_cache=use_cache)
+    sums = fitting.NormalSums(domain, degree)
+    sums.addFolds(run.damped_temp, run.period, run.weights)
+    return sums
+
+def pooledFit(executor, filenames, damp_factor, degree, domain, resample_hz = None, use_cache = True):
+    # domain: has to cover the temperatures of all runs
+    sums = fitting.NormalSums(domain, degree)
+    n = len(filenames)
+    for part in executor.map(dampedSums, filenames, [damp_factor] * n, [degree] * n, [domain] * n,
+                             [resample_hz] * n, [use_cache] * n):
+        sums.merge(part)
+    return pipeline.Fit.fromSums(sums)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='batch.py',
+                description='Calibrates many sensor log databases at once')
+    parser.add_argument('runs', nargs='+', help=f'Databases, globs, or directories (searched for {RUN_PATTERN})')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    parser.add_argument('--sweep-steps', type=int, default=pipeline.SWEEP_STEPS)
+    parser.add_argument('--damp-factor', type=float, default=None, help='Use this for every run instead of sweeping')
+    parser.add_argument('--latency', choices=pipeline.ENGINES, default='extrema', help='Phase latency engine of the sweep')
+    parser.add_argument('--resample', type=float, default=None, metavar='HZ', help='Analyse on a uniform time grid of that rate')
+    parser.add_argument('--fit-degree', type=lambda s: None if s == 'auto' else int(s), default=pipeline.FIT_DEGREE,
+                        help="Of the polynom, or 'auto' to cross-validate it per run (the pooled fit takes the median)")
+    parser.add_argument('--no-cache', default=True, action='store_false', dest='cache')
+    parser.add_argument('--pooled', default=False, action='store_true',
+                        help='Also fit all runs together, damped with the median damp factor (or --damp-factor)')
+    parser.add_argument('--output', default=None, help='Write the summary table as CSV, too')
+    args = parser.parse_args()
+
+    filenames = findRuns(args.runs)
+    if not filenames:
+        print ("No runs found.")
+        exit(1)
+    print (f"Calibrating {len(filenames)} run(s)")
+
+    n = len(filenames)
+    with ProcessPoolExecutor(args.workers) as executor:
+        summaries = list(executor.map(calibrate, filenames, [args.sweep_steps] * n,
+                                      [args.damp_factor] * n, [args.cache] * n, [args.latency] * n, [args.resample] * n,
+                                      [args.fit_degree] * n))
+        table = pd.DataFrame(summaries).set_index('database')
+        good = table[table['error'].isnull()] if 'error' in table else table
+
+        with pd.option_context('display.max_columns', None, 'display.width', None, 'display.float_format', '{:.6g}'.format):
+            print (table.drop(columns='error'))
+        for filename, error in table['error'].dropna().items():
+            print (f"{filename}: {error}")
+        if len(good):
+            print (f"\nDamp factor: median {good['damp_factor'].median()}, spread {good['damp_factor'].std()}")
+
+        if args.output:
+            table.to_csv(args.output)
+            print (f"Summary in {args.output}")
+
+        if args.pooled and len(good):
+            damp_factor = args.damp_factor if args.damp_factor is not None else good['damp_factor'].median()
+            # one common domain for all parts, so the sums can be merged (the damped temperature stays within the raw one)
+            domain = (float(good['temp_min'].min()), float(good['temp_max'].max()))
+            degree = args.fit_degree if args.fit_degree is not None else int(round(good['degree'].median()))
+            fit = pooledFit(executor, list(good.index), damp_factor, degree, domain, args.resample, args.cache)
+            print (f"\nPooled fit over {len(good)} run(s), {int(good['samples'].sum())} samples, damped ({damp_factor}):")
+            print (f"**\nFactors of best fit: {fit.asFunction()}\n**")
+            print ("Covariance of fit:")
+            print (fit.covariance)
+            print ("C++ (Horner, conditioned):")
+            print (fit.cpp())
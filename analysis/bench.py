@@ -0,0 +1,226 @@
+#!/usr/bin/python
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from argparse import ArgumentParser
+
+import data
+import loader
+import pipeline
+from damper import dampen
+
+# Benchmarks the analysis pipeline on synthetic runs with known parameters:
+# temperature is a sum of slow sines, the period follows a known polynomial of
+# the temperature damped with a known factor, plus noise. Every stage is timed,
+# and because we know the truth, we also check what the pipeline recovers.
+#
+#   ./bench.py --rows 10000 1000000 --output bench.json
+
+TRUE_POLYNOM = (995000.0, 1.5, -4e-5)  # lowest order first, like config.hpp
+TRUE_DAMP_FACTOR = 0.004
+RESAMPLE_HZ = 0.2
+
+def synthesize(num_rows, seed = 1):
+    rng = np.random.default_rng(seed)
+    t = np.arange(num_rows)
+    temp = (2200 + 300 * np.sin(2 * np.pi * t / 1500) + 80 * np.sin(2 * np.pi * t / 377)
+            + rng.normal(0, 3, num_rows)).astype(np.int64)
+    temp_damped = dampen(TRUE_DAMP_FACTOR, temp)
+    period = (np.polynomial.polynomial.polyval(temp_damped, TRUE_POLYNOM)
+              + rng.normal(0, 5, num_rows)).astype(np.int64)
+    return {
+        'period': period,
+        'temperature': temp,
+        'pressure': np.full(num_rows, 101325 << 8),
+        'humidity': np.full(num_rows, 40 << 10),
+        'temperature_damped': temp_damped,
+        'period_estimate': period,
+        'time_estimate': np.cumsum(period),
+        'estimate_diff': np.zeros(num_rows, dtype=np.int64),
+    }
+
+def writeDatabase(filename, columns, chunk_rows = loader.DEFAULT_CHUNK_ROWS):
+    db = sqlite3.connect(filename)
+    db.execute(f"CREATE TABLE {data.TABLE_NAME} ({', '.join([col.getSql() for col in data.TABLE_FORMAT.values()])})")
+    insert = f"INSERT INTO {data.TABLE_NAME} VALUES ({', '.join(['?'] * len(data.TABLE_FORMAT))})"
+    keys = list(data.TABLE_FORMAT.keys())
+    num_rows = len(columns['period'])
+    for offset in range(0, num_rows, chunk_rows):
+        chunk = [columns[key][offset:offset + chunk_rows].tolist() for key in keys]
+        db.executemany(insert, zip(*chunk))
+    db.commit()
+    db.close()
+
+def syntheticDatabase(directory, num_rows, seed = 1):
+    filename = os.path.join(directory, f'synthetic_{num_rows}_{seed}_sensor_log.db')
+    if not os.path.exists(filename):
+        tmp = filename + '.tmp'
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        writeDatabase(tmp, synthesize(num_rows, seed))
+        os.replace(tmp, filename)
+    return filename
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, fn, *args, **kwargs):
+        wall, cpu = time.perf_counter(), time.process_time()
+        ret = fn(*args, **kwargs)
+        self.stages[name] = {
+            'wall_s': time.perf_counter() - wall,
+            'cpu_s': time.process_time() - cpu,
+        }
+        print (f"  {name:>12}: {self.stages[name]['wall_s']:.3f}s")
+        return ret
+
+
+def benchAnalysis(filename, workers = None):
+    timer = StageTimer()
+    raw = timer.run('load', pipeline.loadColumns, filename)
+    columns, _, measured = timer.run('cleaning', pipeline.cleanColumns, raw)
+    weights = measured.astype(np.float64)  # like pipeline.Run
+    period, temp = columns['period'], columns['temperature']
+    sample_time_s = pipeline.sampleTime(period) / 1000000   # same as pipeline.Run
+
+    temp_smooth, period_smooth = timer.run('smoothing', pipeline.smooth, temp, period)
+    temp_extrema, period_extrema = timer.run('extrema', pipeline.extrema, temp_smooth, period_smooth)
+    timer.run('latency', pipeline.phaseLatency, temp_smooth, period_smooth, sample_time_s,
+              pipeline.LATENCY_WINDOW_S, temp_extrema, period_extrema)
+
+    _, factors = pipeline.sweepFactors(pipeline.SWEEP_STEPS)
+    result = timer.run('sweep', pipeline.dampSweep, temp, period_smooth, sample_time_s, pipeline.LATENCY_WINDOW_S,
+                       factors, workers=workers, period_extrema=period_extrema)
+    damp_factor = result.roots[0] if result.roots else float('nan')
+    xcorr_result = timer.run('xcorr sweep', pipeline.dampSweep, temp, period, sample_time_s,
+                             pipeline.LATENCY_WINDOW_S, factors, workers=workers, engine='xcorr')
+    xcorr_damp_factor = xcorr_result.roots[0] if xcorr_result.roots else float('nan')
+
+    # the same on a 5 s grid: a fifth of the samples
+    sample_time_us = pipeline.sampleTime(period)
+    grid, _, grid_time_us = timer.run('resample', pipeline.resampleColumns, columns, sample_time_us, RESAMPLE_HZ)
+    time_delta = 1000000 / RESAMPLE_HZ / (sample_time_us[-1] / len(period))
+    resampled_result = timer.run('resampled sweep', pipeline.dampSweep, grid['temperature'], grid['period'],
+                                 grid_time_us / 1000000, pipeline.LATENCY_WINDOW_S, factors, workers=workers,
+                                 engine='xcorr', time_delta=time_delta)
+    resampled_damp_factor = resampled_result.roots[0] if resampled_result.roots else float('nan')
+
+    # the objects pipeline.Run fits and rates with
+    damped = dampen(damp_factor if result.roots else TRUE_DAMP_FACTOR, temp)
+    fit = timer.run('fit', pipeline.Fit, damped, period, len(TRUE_POLYNOM) - 1, weights)
+    uncorrected = pipeline.Deviation(data.TABLE_FORMAT['period'].normalize(period))
+    stats = timer.run('stats', pipeline.Stats, fit(damped), period, uncorrected,
+                      sample_time_us[-1] / np.sum(weights), weights)
+
+    return {
+        'rows': len(period),
+        'stages': timer.stages,
+        'sweep_evaluations': result.evaluations,
+        'recovery': {
+            'damp_factor': damp_factor,
+            'damp_factor_true': TRUE_DAMP_FACTOR,
+            'damp_factor_rel_error': abs(damp_factor - TRUE_DAMP_FACTOR) / TRUE_DAMP_FACTOR,
+            'damp_factor_xcorr': xcorr_damp_factor,
+            'damp_factor_xcorr_rel_error': abs(xcorr_damp_factor - TRUE_DAMP_FACTOR) / TRUE_DAMP_FACTOR,
+            'damp_factor_resampled': resampled_damp_factor,
+            'damp_factor_resampled_rel_error': abs(resampled_damp_factor - TRUE_DAMP_FACTOR) / TRUE_DAMP_FACTOR,
+            'polynom': [float(c) for c in fit.conditioned.power()],
+            'polynom_true': list(TRUE_POLYNOM),
+            # at the mean temperature, where the fit is well defined
+            'period_error_at_mean_temp': float(fit(np.mean(temp))
+                                               - np.polynomial.polynomial.polyval(np.mean(temp), TRUE_POLYNOM)),
+            'residual_std': float(stats.corrected.std),
+            'drift_s': float(stats.drift_s),
+        },
+    }
+
+
+def benchIngestion(num_rows, binary = False):
+    import serial
+    import ingest
+    import telemetry
+
+    columns = synthesize(num_rows)
+    keys = list(data.TABLE_FORMAT.keys())
+    if binary:
+        frames = np.zeros(num_rows, dtype=telemetry.FRAME_DTYPE)
+        frames['sync'] = telemetry.SYNC_WORD
+        frames['sequence'] = np.arange(num_rows) % (1 << 16)
+        for key in keys:
+            frames[key] = columns[key]
+        frames['crc'] = telemetry.crc16(frames.view(np.uint8).reshape(num_rows, -1)[:, telemetry._CRC_BEGIN:telemetry._CRC_END])
+        payload = frames.tobytes()
+    else:
+        lines = zip(*[columns[key].tolist() for key in keys])
+        payload = "".join(",".join(str(v) for v in line) + "\n" for line in lines).encode()
+
+    # a pty is as close to the real USB CDC device as it gets without hardware
+    master, slave = os.openpty()
+    device = serial.Serial(os.ttyname(slave), timeout=0.2)
+    db = ingest.openDatabase(':memory:')
+
+    def feed():
+        view = memoryview(payload)
+        while len(view):
+            # blocks when the pty buffer is full, like a device with flow control
+            written = os.write(master, view[:1 << 16])
+            view = view[written:]
+        while device.in_waiting:
+            time.sleep(0.01)
+        os.close(master)
+
+    feeder = threading.Thread(target=feed)
+    start = time.perf_counter()
+    feeder.start()
+    try:
+        ingest.run(device, db, print_every_s=float('inf'), binary=binary)
+    except serial.SerialException:
+        pass    # that's the closed master
+    wall = time.perf_counter() - start
+    feeder.join()
+    stored = db.execute(f"SELECT COUNT(1) FROM {data.TABLE_NAME}").fetchone()[0]
+    db.close()
+    device.close()
+    os.close(slave)
+    return {
+        'rows': num_rows,
+        'stored': stored,
+        'binary': binary,
+        'wall_s': wall,
+        'rows_per_s': stored / wall,
+    }
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='bench.py',
+                description='Benchmarks the analysis and logging pipeline on synthetic data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 1000000, 10000000])
+    parser.add_argument('--ingest-rows', type=int, default=100000, help='0 to skip the ingestion benchmark')
+    parser.add_argument('--directory', default='bench_data', help='Where synthetic databases are kept')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default='bench.json')
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+    results = {'analysis': [], 'ingestion': []}
+    for num_rows in args.rows:
+        print (f"Analysis, {num_rows} rows:")
+        filename = syntheticDatabase(args.directory, num_rows)
+        results['analysis'].append(benchAnalysis(filename, args.workers))
+
+    if args.ingest_rows:
+        for binary in (False, True):
+            print (f"Ingestion, {args.ingest_rows} rows ({'binary' if binary else 'CSV'}):")
+            results['ingestion'].append(benchIngestion(args.ingest_rows, binary))
+            print (f"\n  {results['ingestion'][-1]['rows_per_s']:.0f} rows/s")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print (f"Results in {args.output}")
@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+
+import archive
+
+# On-disk memo for derived series (smoothed curves, extrema, sample times),
+# next to the database:
+#
+#   2024-01-01_12-00-00_sensor_log.db
+#   2024-01-01_12-00-00_sensor_log.cache/
+#       source.json             fingerprint of the database the entries belong to
+#       <name>-<hash>.npz       one entry, hash over name + parameters
+#
+# If the database changed (size/mtime, including its WAL), the entries are
+# thrown away on first use. Only those: a directory of that name without a
+# source.json is none of ours, and then there is no caching at all.
+
+SOURCE_FILE = 'source.json'
+ENTRY_PATTERN = re.compile(r'\w+-[0-9a-f]{16}\.npz(\.tmp\.npz)?')
+
+def cachePath(db_filename):
+    return os.path.splitext(db_filename)[0] + '.cache'
+
+class DerivedCache:
+    def __init__(self, db_filename, enabled = True):
+        self.path = cachePath(db_filename)
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        if enabled:
+            self._validate(archive.sourceFingerprint(db_filename))
+
+    def _validate(self, fingerprint):
+        source_file = os.path.join(self.path, SOURCE_FILE)
+        try:
+            with open(source_file) as f:
+                if json.load(f) == fingerprint:
+                    return
+        except (OSError, ValueError):
+            pass
+        try:
+            if os.path.isdir(self.path):
+                names = os.listdir(self.path)
+                if names and SOURCE_FILE not in names:
+                    print (f"{self.path} is not a cache of this tool, not caching.")
+                    self.enabled = False
+                    return
+                for name in names:
+                    if name == SOURCE_FILE or ENTRY_PATTERN.fullmatch(name):
+                        os.remove(os.path.join(self.path, name))
+            os.makedirs(self.path, exist_ok=True)
+            with open(source_file, 'w') as f:
+                json.dump(fingerprint, f)
+        except OSError:
+            # e.g. read-only next to the database. Just don't cache then.
+            self.enabled = False
+
+    def _entryFile(self, name, params):
+        key = json.dumps([name, params], sort_keys=True, default=str)
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return os.path.join(self.path, f'{name}-{digest}.npz')
+
+    def get(self, name, params, compute):
+        # compute() returns an array or a tuple of arrays; so does get()
+        if not self.enabled:
+            return compute()
+        entry = self._entryFile(name, params)
+        try:
+            with np.load(entry) as stored:
+                value = tuple(stored[f'arr_{i}'] for i in range(len(stored.files) - 1))
+                is_tuple = bool(stored['is_tuple'])
+            self.hits += 1
+            return value if is_tuple else value[0]
+        except (OSError, KeyError, ValueError):
+            pass
+
+        self.misses += 1
+        value = compute()
+        is_tuple = isinstance(value, tuple)
+        arrays = value if is_tuple else (value,)
+        tmp = entry + '.tmp.npz'
+        np.savez(tmp, *arrays, is_tuple=is_tuple)
+        os.replace(tmp, entry)
+        return value
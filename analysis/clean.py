@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import json
+import os
+import numpy as np
+from scipy.ndimage import median_filter
+from argparse import ArgumentParser
+
+import archive
+
+# Cleaning of a recorded run, instead of fixed "Temperature > x AND Period > y"
+# filters. All vectorized, one go over the columns:
+#
+#   invalid:  the BME280 failed and the firmware sent invalidMeasurement
+#   outliers: more than THRESHOLD (MAD based) sigmas off the rolling median
+#   gaps:     rows the firmware sent that never made it into the database
+#             (garbage on the line, the logger fell behind, ...). Found via the
+#             firmware's time_estimate, which advances by llround(period_estimate)
+#             per sent sample. Implausible periods the firmware skips aren't
+#             gaps: they are neither sent nor counted in time_estimate (see
+#             main.cpp), so the estimate and the reference time both leave them out.
+#
+# Then either everything bad is dropped ('mask'), or bad values are
+# interpolated and missing rows inserted, so that cumsum(period) is the
+# reference time again ('interpolate').
+
+KEYS = ('period', 'temperature', 'time_estimate', 'period_estimate')
+CHECKED_KEYS = ('period', 'temperature')
+MODES = ('interpolate', 'mask')
+INVALID = {'temperature': -6666}    # BME280::invalidMeasurement
+WINDOW = 31         # samples, for the rolling median
+THRESHOLD = 8       # in sigmas, estimated as 1.4826 MAD
+MAD_TO_SIGMA = 1.4826
+# raw units. The MAD of a flat, quantized stretch is 0, and then everything would be an outlier.
+MIN_SIGMA = {'period': 10, 'temperature': 2}
+
+def parameters(mode):
+    # what the cleaned columns depend on (e.g. for cache.py)
+    return {'mode': mode, 'invalid': INVALID, 'window': WINDOW, 'threshold': THRESHOLD, 'min_sigma': MIN_SIGMA}
+
+def interpolate(x, bad):
+    # bad values linearly from their good neighbours (by index)
+    if not bad.any() or bad.all():
+        return x
+    good = np.flatnonzero(~bad)
+    ret = np.array(x, dtype=np.float64)
+    ret[bad] = np.interp(np.flatnonzero(bad), good, ret[good])
+    return ret
+
+def outliers(x, window = WINDOW, threshold = THRESHOLD, min_sigma = 0):
+    x = np.asarray(x, dtype=np.float64)
+    residual = x - median_filter(x, size=window, mode='nearest')
+    sigma = MAD_TO_SIGMA * median_filter(np.abs(residual), size=window, mode='nearest')
+    return np.abs(residual) > threshold * np.maximum(sigma, min_sigma)
+
+def findGaps(time_estimate, period_estimate):
+    # (row after each gap, rows lost before it), and rows where the time went backwards (reboot)
+    step = np.diff(np.asarray(time_estimate, dtype=np.int64))
+    expected = np.maximum(np.rint(np.asarray(period_estimate[1:], dtype=np.float64)), 1)
+    missing = np.rint(step / expected).astype(np.int64) - 1
+    gaps = np.flatnonzero(missing > 0)
+    return gaps + 1, missing[gaps], np.flatnonzero(step < 0) + 1
+
+def insertRows(columns, rows, counts):
+    # counts[i] interpolated rows before rows[i], in all columns
+    length = len(next(iter(columns.values())))
+    inserted = np.zeros(length, dtype=np.int64)
+    inserted[rows] = counts
+    position = np.arange(length) + np.cumsum(inserted)
+    new_positions = np.arange(length + inserted.sum())
+    return {key: np.interp(new_positions, position, np.asarray(column, dtype=np.float64))
+            for key, column in columns.items()}
+
+def clean(columns, mode = 'interpolate'):
+    # -> (cleaned columns plus 'measured', report). Columns raw, KEYS at least for gap detection.
+    assert mode in MODES
+    columns = dict(columns)
+    num_rows = len(columns['period'])
+    report = {'mode': mode, 'rows': num_rows, 'invalid': {}, 'outliers': {}}
+    bad = np.zeros(num_rows, dtype=bool)
+
+    for key in CHECKED_KEYS:
+        invalid = columns[key] == INVALID[key] if key in INVALID else np.zeros(num_rows, dtype=bool)
+        # invalid ones would drag the medians
+        valid = interpolate(columns[key], invalid)
+        outlier = outliers(valid, min_sigma=MIN_SIGMA[key]) & ~invalid
+        report['invalid'][key] = int(invalid.sum())
+        report['outliers'][key] = int(outlier.sum())
+        if mode == 'interpolate':
+            columns[key] = interpolate(valid, outlier)
+        bad |= invalid | outlier
+
+    if 'time_estimate' in columns and 'period_estimate' in columns:
+        rows, missing, restarts = findGaps(columns['time_estimate'], columns['period_estimate'])
+        # no reconstructing across a reboot, the firmware's time started over there
+        keep = ~np.isin(rows, restarts)
+        rows, missing = rows[keep], missing[keep]
+        report['gaps'] = len(rows)
+        report['missing'] = int(missing.sum())
+        report['longest_gap'] = int(missing.max()) if len(missing) else 0
+        report['restarts'] = len(restarts)
+    else:
+        rows, missing = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    if mode == 'mask':
+        columns = {key: column[~bad] for key, column in columns.items()}
+        report['dropped'] = int(bad.sum())
+        measured = np.ones(len(columns['period']), dtype=bool)
+    else:
+        report['interpolated'] = int(bad.sum())
+        measured = ~bad
+        if len(rows):
+            columns = insertRows(columns, rows, missing)
+            inserted = np.ones(len(columns['period']), dtype=bool)
+            inserted[np.arange(num_rows) + np.cumsum(np.bincount(rows, missing, num_rows).astype(np.int64))] = False
+            measured = np.zeros(len(inserted), dtype=bool)
+            measured[~inserted] = ~bad
+    report['rows_out'] = len(columns['period'])
+    # whether a row is what was measured, or made up here (e.g. for weights)
+    columns['measured'] = measured
+    return columns, report
+
+def describe(report) -> str:
+    ret = (f"{report['rows']} rows -> {report['rows_out']} ({report['mode']}); "
+           f"invalid: {', '.join(f'{k} {v}' for k, v in report['invalid'].items())}; "
+           f"outliers: {', '.join(f'{k} {v}' for k, v in report['outliers'].items())}")
+    if 'gaps' in report:
+        ret += (f"; {report['gaps']} gap(s), {report['missing']} row(s) lost between firmware and database, "
+                f"longest {report['longest_gap']}, {report['restarts']} restart(s)")
+    return ret
+
+def reportPath(db_filename):
+    return os.path.splitext(db_filename)[0] + '.quality.json'
+
+def writeReport(report, filename):
+    with open(filename, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='clean.py',
+                description='Checks sensor log databases for invalid samples, outliers and gaps')
+    parser.add_argument('database', nargs='+')
+    parser.add_argument('--mode', choices=MODES, default='interpolate')
+    args = parser.parse_args()
+
+    for db_filename in args.database:
+        _, report = clean(archive.load(db_filename, KEYS, normalize=False), args.mode)
+        writeReport(report, reportPath(db_filename))
+        print (f"{db_filename}: {describe(report)}")
@@ -0,0 +1,43 @@
+import numpy as np
+from scipy.signal import lfilter
+
+# Same arithmetic as `Damper` in src/estimator.hpp, but as an IIR filter:
+#   y[n] = y[n-1] + (x[n] - y[n-1]) * f  =  f * x[n] + (1 - f) * y[n-1]
+# with the filter state primed so that y[0] == x[0] (the firmware has no
+# estimate before the first sample and takes the first value as-is).
+
+class Damper:
+    # Stateful version for data that arrives in chunks (ingestion, chunked reader)
+    def __init__(self, factor):
+        self.factor = factor
+        self.estimate = None
+
+    def consume(self, xs):
+        xs = np.asarray(xs, dtype=np.float64)
+        if len(xs) == 0:
+            return xs
+        previous = xs[0] if self.estimate is None else self.estimate
+        b = [self.factor]
+        a = [1, self.factor - 1]
+        damped, _ = lfilter(b, a, xs, zi=[(1 - self.factor) * previous])
+        self.estimate = damped[-1]
+        return damped
+
+def stepFactor(factor, time_delta = None):
+    # The factor is per sample, like in the firmware. For steps of time_delta
+    # samples (e.g. on a grid, see resample.py), the one with the same time constant.
+    return factor if time_delta is None else 1 - (1 - factor) ** time_delta
+
+def dampen(factor, xs, time_delta = None):
+    # time_delta: length of a step of xs in samples, None for one value per sample
+    return Damper(stepFactor(factor, time_delta)).consume(xs)
+
+def dampenMany(factors, xs, time_delta = None):
+    # One row per factor. lfilter only takes one set of coefficients per call,
+    # so we still iterate over the (few) factors, but never over the samples.
+    xs = np.asarray(xs, dtype=np.float64)
+    factors = np.atleast_1d(np.asarray(factors, dtype=np.float64))
+    ret = np.empty((len(factors), len(xs)))
+    for i, factor in enumerate(factors):
+        ret[i] = dampen(factor, xs, time_delta)
+    return ret
@@ -1,11 +1,14 @@
 TABLE_NAME = 'logdata'
 
 class ColDesc:
-    def __init__(self, name, type, unit, fractional = 1):
+    def __init__(self, name, type, unit, fractional = 1, wire = '<i4', storage = None):
         self.name = name
         self.type = type
         self.unit = unit
         self.fractional = fractional
+        self.wire = wire    # numpy dtype in the binary telemetry frame (see src/telemetry.hpp)
+        # numpy dtype of what SQLite gives back (see loader.py): 64 bit, so nothing wraps or rounds
+        self.storage = storage or ('<f8' if type == 'REAL' else '<i8')
 
     def getSql(self) -> str:
         return f"\'{self.name}' {self.type}"
@@ -21,15 +24,24 @@ class ColDesc:
 
 # "oversampling"
 expected_frequency = 1 / 440    # should be the same value as in config.hpp!
+damp_factor = 0.002279174504551375  # should be the same value as in config.hpp!
 
 TABLE_FORMAT = {
-    'period': ColDesc('Period', 'INTEGER', 'us', expected_frequency),
-    'temperature': ColDesc('Temperature', 'INTEGER', 'Degree Celsius', 0.01),
-    'pressure': ColDesc('Pressure', 'INTEGER', 'Pa', pow(2,-8)),
-    'humidity': ColDesc('Humidity', 'INTEGER', '%RH', pow(2,-10)),
-    'temperature_damped' : ColDesc('TempDamp', 'INTEGER', 'Degree Celsius', 0.01),
-    'period_estimate' : ColDesc('PeriodEstimate', 'INTEGER', 'us', expected_frequency),
-    'time_estimate' : ColDesc('TimeEstimate', 'INTEGER', 'us', 1),
-    'estimate_diff' : ColDesc('EstimateDiff', 'INTEGER', 'us', 1),
+    'period': ColDesc('Period', 'INTEGER', 'us', expected_frequency, '<u4'),
+    'temperature': ColDesc('Temperature', 'INTEGER', 'Degree Celsius', 0.01, '<i4'),
+    'pressure': ColDesc('Pressure', 'INTEGER', 'Pa', pow(2,-8), '<u4'),
+    'humidity': ColDesc('Humidity', 'INTEGER', '%RH', pow(2,-10), '<u4'),
+    'temperature_damped' : ColDesc('TempDamp', 'INTEGER', 'Degree Celsius', 0.01, '<f4', '<f8'),    # declared INTEGER, holds REALs
+    'period_estimate' : ColDesc('PeriodEstimate', 'INTEGER', 'us', expected_frequency, '<f8', '<f8'),
+    'time_estimate' : ColDesc('TimeEstimate', 'INTEGER', 'us', 1, '<u8'),
+    'estimate_diff' : ColDesc('EstimateDiff', 'INTEGER', 'us', 1, '<i8'),
 }
 
+# Not sent by the firmware, added by the logger (ingest.DbWriter), indexed. Older
+# databases get them from migrate.py.
+TIME_COLUMNS = {
+    'reference_time': ColDesc('ReferenceTime', 'INTEGER', 'us', 1, '<i8'),  # cumulative Period, 0 before the first sample
+    'host_time': ColDesc('HostTime', 'REAL', 's', 1, '<f8'),    # when the logger got the sample, unix time
+}
+
+COLUMNS = {**TABLE_FORMAT, **TIME_COLUMNS}
@@ -0,0 +1,153 @@
+import matplotlib.pyplot as plt
+import numpy as np
+
+import data
+import instrument
+import pipeline
+import pyramid
+
+# The plots of estimate.py, one function per figure, all taking a pipeline.Run.
+# Only imported when plots are wanted, so headless runs don't pay for matplotlib.
+# Long series go through pyramid.plotLevels, so they cost pixels instead of samples.
+
+period_meta = data.TABLE_FORMAT['period']
+temp_meta = data.TABLE_FORMAT['temperature']
+LATENCY_BIN_S = 10  # of the latency histogram
+
+def legendAllAxes(*axis):
+    lines = [line for ax in axis for line in ax.get_lines()]
+    labs = [l.get_label() for l in lines if not '_' in l.get_label() ]
+    axis[0].legend(lines, labs)
+
+def latencyHistogram(run):
+    base_latency_s, _, _, common_time_diffs = run.phase_latency
+    plt.figure()
+    plt.hist(common_time_diffs, max(1, int(run.window / LATENCY_BIN_S)), label="Extrema")
+    plt.axvline(base_latency_s, color="red", label="Mean", linestyle="dotted")
+    plt.axvline(np.median(common_time_diffs), color="blue", label="Median", linestyle="dotted")
+    plt.xlabel("Time difference [s]")
+    plt.ylabel("Num occurrences")
+    plt.legend()
+    plt.title("Distribution of Time-Difference between Extrema")
+
+def measurementData(run):
+    # Print temp and period, along with the damping-series
+    _, common_temp_extrema, common_period_extrema, _ = run.phase_latency
+    sample_time_s, period, temp = run.sample_time_s, run.period, run.temp
+    period_smooth, temp_smooth = run.period_smooth, run.temp_smooth
+
+    fig, ax1 = plt.subplots()
+    ax2 = ax1.twinx()
+    ax1.set_xlabel('Time [s]')
+    ax1.ticklabel_format(style='plain')
+    ax1.set_ylabel('Period per cycle [us]')
+    pyramid.plotLevels(ax1, sample_time_s, period_meta.normalize(period), 'orange', alpha=.7, label='Period')
+    pyramid.plotLevels(ax1, sample_time_s, period_meta.normalize(period_smooth), 'orangered', alpha=.7, label='Period (Smooth)')
+    ax1.scatter(sample_time_s[common_period_extrema[0]], period_meta.normalize(period_smooth[common_period_extrema[0]]),
+                s=100, color="red", marker='1', label="Maxima")
+    ax1.scatter(sample_time_s[common_period_extrema[1]], period_meta.normalize(period_smooth[common_period_extrema[1]]),
+                s=100, color="red", marker='2', label="Minima")
+
+    ax2.set_ylabel('Scaled Temperature [Celsius]')
+    pyramid.plotLevels(ax2, sample_time_s, temp_meta.normalize(temp), 'firebrick', alpha=.7, label='Temperature')
+    pyramid.plotLevels(ax2, sample_time_s, temp_meta.normalize(temp_smooth), 'darkred', alpha=.7, label='Temperature (Smooth)')
+    ax2.scatter(sample_time_s[common_temp_extrema[0]], temp_meta.normalize(temp_smooth[common_temp_extrema[0]]),
+                s=100, color="blue", marker='1', label="Maxima")
+    ax2.scatter(sample_time_s[common_temp_extrema[1]], temp_meta.normalize(temp_smooth[common_temp_extrema[1]]),
+                s=100, color="blue", marker='2', label="Minima")
+
+    lin_fs, sweep_factors = run.sweep_factors
+    bounds = (min(pipeline.SCALED_INTEREST_BOUNDS), max(pipeline.SCALED_INTEREST_BOUNDS))
+    for lin_f, factor, damped_temp in zip(lin_fs, sweep_factors, run.sweepCurves()):
+        if factor > bounds[0] and factor < bounds[1]:
+            pyramid.plotLevels(ax2, sample_time_s, temp_meta.normalize(damped_temp),
+                color=f'#{int(lin_f * 0xFF):02x}{int((1-lin_f) * 0xFF):02x}115A',
+                # TODO: Generate only one of these descriptions but with all colors
+                )
+    ax1.legend(loc="upper right")
+    ax2.legend(loc="upper left")
+    plt.title("Measurement data")
+
+def sweepCurve(run):
+    zero_crossings = run.sweep.roots
+    plt.figure()
+    if zero_crossings:
+        plt.title(f"Estimation of best damp factor: {zero_crossings[0]}")
+
+    plt.plot(run.sweep.factors, run.sweep.latencies, label="Calculated")
+    plt.axhline(0, linestyle='dashed', color='lightblue', alpha=.5, label="Ideal zero")
+    for zero_crossing in zero_crossings:
+        plt.axvline(zero_crossing, color="green", alpha=.75, label="Refined Crossing Point")
+    plt.legend()
+    plt.xlabel("Damp-Factor")
+    plt.ylabel("Avg. Extremum Time Difference")
+
+def getNormalizedRangeAndBin(thing, thing_meta):
+    range = (min(thing_meta.normalize(thing)) - 1, max(thing_meta.normalize(thing)) + 1)
+    resolution = 2 # thing_meta.normalize(1) # because we don't need that many bins
+    bin = max(1, (range[1] - range[0]) * resolution)
+    return (range, bin)
+
+def correlation(run):
+    # THe scatter-plot. Watch out, it takes some time.
+    period, temp = run.period, run.temp
+    temp_range_n, _ = getNormalizedRangeAndBin(temp, temp_meta)
+    valid_period_fit_range_n = np.arange(temp_range_n[0], temp_range_n[1], temp_meta.normalize(1))
+    valid_period_fit_range = temp_meta.denormalize(valid_period_fit_range_n)
+
+    # limit scattering to less samples to reduce time overhead
+    num_samples_to_scatter = min(5000, len(period)/2)
+    ss_step_size = int(len(period) / num_samples_to_scatter)
+    period_ss = period[0::ss_step_size]
+
+    plt.figure()
+    temp_edges, period_edges, counts = run.histogram.occupied()
+    plt.pcolormesh(temp_meta.normalize(temp_edges), period_meta.normalize(period_edges), counts.T)
+    plt.scatter(temp_meta.normalize(temp[0::ss_step_size]), period_meta.normalize(period_ss),
+                alpha=.15,
+                label="Measured samples", color="blue")
+    plt.scatter(temp_meta.normalize(run.damped_temp[0::ss_step_size]), period_meta.normalize(period_ss),
+                alpha=.15, color="lightgreen", label=f"Damped Temperature")
+
+    plt.plot(valid_period_fit_range_n, period_meta.normalize(run.fit(valid_period_fit_range)),
+            'red', label="Best fit")
+    plt.plot(valid_period_fit_range_n, period_meta.normalize(run.damped_fit(valid_period_fit_range)),
+            'teal', label="Best fit (damped)")
+
+    plt.legend()
+    plt.ticklabel_format(style='plain')
+    plt.xlabel('Scaled Temperature [Celsius]')
+    plt.ylabel('Period per one cycle [us]')
+    plt.title("Correlation Data")
+
+def correction(run):
+    sample_time_s, period = run.sample_time_s, run.period
+    fig, ax1 = plt.subplots()
+    plt.title("Correction Factor Estimation")
+    ax1.set_xlabel('Time [s]')
+    ax2 = ax1.twinx()
+    ax1.set_ylabel('Period per one Cycle [us]')
+    pyramid.plotLevels(ax1, sample_time_s, period_meta.normalize(period), 'green', label="Measured Period")
+    pyramid.plotLevels(ax1, sample_time_s, period_meta.normalize(run.stats.estimated_period), 'darkred', label="Estimated Period")
+    pyramid.plotLevels(ax1, sample_time_s, period_meta.normalize(run.damped_stats.estimated_period), 'orange', label="Estimated Period (Damped)")
+
+    ax2.set_ylabel('Difference [us]')
+    pyramid.plotLevels(ax2, sample_time_s, period_meta.normalize(run.stats.difference),
+            'blue', label='Difference')
+    pyramid.plotLevels(ax2, sample_time_s, period_meta.normalize(run.damped_stats.difference),
+            'teal', label='Difference (Damped)')
+    ax2.axhline(0, linestyle='dashed', color='lightblue', alpha=.5)
+    pyramid.plotLevels(ax2, sample_time_s, period_meta.normalize(run.damped_stats.difference),
+                       draw=lambda ax, t, lo, hi, mean: [ax.fill_between(t, mean, 0, color='teal', alpha=.5)])
+    legendAllAxes(ax1, ax2)
+
+def render():
+    # matplotlib draws lazily, when profiling this is where the artists' cost shows up
+    if instrument.PROFILER.enabled:
+        with instrument.stage('render'):
+            for number in plt.get_fignums():
+                plt.figure(number).canvas.draw()
+
+def show():
+    render()
+    plt.show()
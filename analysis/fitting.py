@@ -0,0 +1,165 @@
+import numpy as np
+from numpy.polynomial import chebyshev, Chebyshev, Polynomial
+
+# Period over (damped) temperature, but conditioned: x is mapped onto [-1, 1]
+# and the basis is Chebyshev, so the normal equations stay sane at higher
+# orders. np.polyfit on raw centidegrees (x^6 ~ 1e20) loses digits quickly.
+#
+# Everything goes through weighted normal-equation sums, accumulated chunk by
+# chunk and per fold. Cross-validating all orders up to MAX_DEGREE then only
+# needs the sums: Chebyshev bases are nested, a lower order is a sub-matrix.
+#
+# For the firmware, the result comes as Horner coefficients in
+# u = (x - center) / scale, see CompensationEstimator in estimator.hpp.
+
+MAX_DEGREE = 6
+FOLDS = 5
+
+def domainOf(x):
+    lo, hi = float(np.min(x)), float(np.max(x))
+    if lo == hi:
+        lo, hi = lo - 1, hi + 1
+    return lo, hi
+
+def mapToWindow(x, domain):
+    lo, hi = domain
+    return (2 * np.asarray(x, dtype=np.float64) - (lo + hi)) / (hi - lo)
+
+
+class NormalSums:
+    # V^T W V, V^T W y, y^T W y per fold, V the Chebyshev-Vandermonde matrix
+    def __init__(self, domain, degree, folds = 1):
+        self.domain = domain
+        self.degree = degree
+        self.vtv = np.zeros((folds, degree + 1, degree + 1))
+        self.vty = np.zeros((folds, degree + 1))
+        self.yty = np.zeros(folds)
+        self.weight = np.zeros(folds)
+        self.count = np.zeros(folds, dtype=np.int64)
+
+    def add(self, x, y, weights = None, fold = 0):
+        v = chebyshev.chebvander(mapToWindow(x, self.domain), self.degree)
+        y = np.asarray(y, dtype=np.float64)
+        w = np.ones(len(y)) if weights is None else np.asarray(weights, dtype=np.float64)
+        wv = v * w[:, None]
+        self.vtv[fold] += wv.T @ v
+        self.vty[fold] += wv.T @ y
+        self.yty[fold] += (w * y) @ y
+        self.weight[fold] += w.sum()
+        self.count[fold] += np.count_nonzero(w)
+
+    def addFolds(self, x, y, weights = None, chunk_rows = 1 << 16):
+        # contiguous blocks as folds (neighbouring samples are anything but independent)
+        bounds = np.linspace(0, len(y), len(self.yty) + 1).astype(np.int64)
+        for fold, (begin, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            for offset in range(begin, end, chunk_rows):
+                stop = min(offset + chunk_rows, end)
+                self.add(x[offset:stop], y[offset:stop],
+                         None if weights is None else weights[offset:stop], fold)
+
+    def merge(self, other):
+        # e.g. the sums of several runs, over the same domain (pass one that covers them all)
+        assert (self.domain, self.degree, len(self.yty)) == (other.domain, other.degree, len(other.yty))
+        self.vtv += other.vtv
+        self.vty += other.vty
+        self.yty += other.yty
+        self.weight += other.weight
+        self.count += other.count
+
+    def total(self):
+        return self.vtv.sum(axis=0), self.vty.sum(axis=0), self.yty.sum(), self.weight.sum(), self.count.sum()
+
+
+class ConditionedFit:
+    def __init__(self, sums, degree = None):
+        degree = sums.degree if degree is None else degree
+        vtv, vty, yty, weight, count = sums.total()
+        # n distinct temperatures (a flat run) only determine degree n - 1, the nested
+        # leading blocks stay regular up to there
+        degree = min(degree, np.linalg.matrix_rank(vtv) - 1)
+        vtv, vty = vtv[:degree + 1, :degree + 1], vty[:degree + 1]
+        self.domain = sums.domain
+        self.degree = degree
+        self.chebyshev = np.linalg.solve(vtv, vty)
+        rss = max(yty - 2 * self.chebyshev @ vty + self.chebyshev @ vtv @ self.chebyshev, 0)
+        # same scaling as np.polyfit(..., cov=True), with the weights as 1/sigma^2
+        self.chebyshev_covariance = np.linalg.inv(vtv) * rss / max(count - (degree + 1), 1) * count / weight
+        self.rms = np.sqrt(rss / weight)
+
+    def __call__(self, x):
+        return chebyshev.chebval(mapToWindow(x, self.domain), self.chebyshev)
+
+    def _toPower(self):
+        # column k: raw power coefficients of the k-th (mapped) Chebyshev polynomial
+        ret = np.zeros((self.degree + 1, self.degree + 1))
+        for k in range(self.degree + 1):
+            coef = Chebyshev.basis(k, domain=self.domain).convert(kind=Polynomial).coef
+            ret[:len(coef), k] = coef
+        return ret
+
+    def power(self):
+        # raw coefficients, lowest order first (like temperatureCalibrationPolynom)
+        return self._toPower() @ self.chebyshev
+
+    def powerCovariance(self):
+        transform = self._toPower()
+        return transform @ self.chebyshev_covariance @ transform.T
+
+    def horner(self):
+        # (center, scale, coefficients lowest order first) with x = center + u * scale.
+        # Horner on u only sees |u| <= 1, so no huge powers cancelling each other.
+        center = (self.domain[0] + self.domain[1]) / 2
+        scale = (self.domain[1] - self.domain[0]) / 2
+        return center, scale, chebyshev.cheb2poly(self.chebyshev)
+
+    def cpp(self) -> str:
+        center, scale, coefficients = self.horner()
+        return "\n".join([
+            "static constexpr std::array temperatureCalibrationPolynom {",
+            *[f"    {float(c)!r}," for c in coefficients],
+            "};",
+            f"static constexpr double temperatureCalibrationCenter {{{float(center)!r}}};",
+            f"static constexpr double temperatureCalibrationScale {{{float(scale)!r}}};",
+        ])
+
+
+def horner(coefficients, x, center = 0, scale = 1):
+    # what the firmware does, lowest order first
+    u = (np.asarray(x, dtype=np.float64) - center) / scale
+    ret = np.full(np.shape(u), coefficients[-1], dtype=np.float64)
+    for c in coefficients[-2::-1]:
+        ret = ret * u + c
+    return ret
+
+def fit(x, y, degree, weights = None) -> ConditionedFit:
+    sums = NormalSums(domainOf(x), degree)
+    sums.addFolds(x, y, weights)
+    return ConditionedFit(sums)
+
+def crossValidate(x, y, max_degree = MAX_DEGREE, weights = None, folds = FOLDS):
+    # -> (best degree, validation RMS per degree 0..max_degree). All folds at once.
+    # Best is the lowest degree within one standard error of the minimum: the
+    # noise alone makes some higher degree win by a hair.
+    sums = NormalSums(domainOf(x), max_degree, folds)
+    sums.addFolds(x, y, weights)
+    total_vtv, total_vty = sums.vtv.sum(axis=0), sums.vty.sum(axis=0)
+    fold_mse = np.full((max_degree + 1, folds), np.nan)
+    for degree in range(max_degree + 1):
+        d = degree + 1
+        fold_vtv, fold_vty = sums.vtv[:, :d, :d], sums.vty[:, :d]
+        train_vtv = total_vtv[:d, :d] - fold_vtv
+        # without the fold, too few distinct temperatures for this degree: that fold doesn't count
+        regular = (np.linalg.matrix_rank(train_vtv) == d) & (sums.count > 0)
+        if not regular.any():
+            break
+        # trained on everything but the fold, one solve for all folds
+        beta = np.linalg.solve(train_vtv[regular], (total_vty[:d] - fold_vty[regular])[..., None])[..., 0]
+        sse = (sums.yty[regular] - 2 * np.einsum('fi,fi->f', beta, fold_vty[regular])
+               + np.einsum('fi,fij,fj->f', beta, fold_vtv[regular], beta))
+        fold_mse[degree, regular] = np.maximum(sse, 0) / sums.weight[regular]
+    tested = ~np.isnan(fold_mse).all(axis=1)
+    mse = np.full(max_degree + 1, np.inf)
+    mse[tested] = np.nanmean(fold_mse[tested], axis=1)
+    best = np.argmin(mse)
+    standard_error = np.nanstd(fold_mse[best]) / np.sqrt(np.count_nonzero(~np.isnan(fold_mse[best])))
+    return int(np.flatnonzero(mse <= mse[best] + standard_error)[0]), np.sqrt(mse)
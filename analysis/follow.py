@@ -0,0 +1,145 @@
+import numpy as np
+
+import data
+import instrument
+import loader
+
+# Live view for a database that log.py is still writing.
+# Tails logdata by rowid and keeps a min/max envelope of a fixed number of
+# buckets per series. Whenever the buckets are full, neighbours are merged and
+# the bucket size doubles. So the whole run stays visible, while memory and
+# redraw cost stay constant no matter how long the capture is running.
+
+class DecimatedSeries:
+    def __init__(self, capacity = 2048):
+        assert capacity % 2 == 0
+        self.capacity = capacity
+        self.bucket_size = 1
+        self.count = 0
+        self.t = np.empty(capacity)
+        self.lo = np.empty(capacity)
+        self.hi = np.empty(capacity)
+        # the bucket currently being filled: (start time, min, max, samples)
+        self._pending = None
+
+    def _halve(self):
+        half = self.capacity // 2
+        self.t[:half] = self.t[0::2]
+        self.lo[:half] = np.minimum(self.lo[0::2], self.lo[1::2])
+        self.hi[:half] = np.maximum(self.hi[0::2], self.hi[1::2])
+        self.count = half
+        self.bucket_size *= 2
+
+    def _store(self, t, lo, hi):
+        # stores as many buckets as fit, returns how many
+        if self.count == self.capacity:
+            self._halve()
+            return 0
+        length = min(len(t), self.capacity - self.count)
+        self.t[self.count:self.count + length] = t[:length]
+        self.lo[self.count:self.count + length] = lo[:length]
+        self.hi[self.count:self.count + length] = hi[:length]
+        self.count += length
+        return length
+
+    def extend(self, t, y):
+        t = np.asarray(t, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        while self._pending is not None and len(t):
+            start, lo, hi, n = self._pending
+            take = self.bucket_size - n
+            lo, hi = min(lo, y[:take].min()), max(hi, y[:take].max())
+            n += len(t[:take])
+            t, y = t[take:], y[take:]
+            self._pending = (start, lo, hi, n)
+            if n < self.bucket_size:
+                return
+            if self.count == self.capacity:
+                # Room first. After that, ours is only half a bucket: keep filling it.
+                self._halve()
+                continue
+            self._store([start], [lo], [hi])
+            self._pending = None
+
+        while len(t) >= self.bucket_size:
+            buckets = len(t) // self.bucket_size
+            used = buckets * self.bucket_size
+            bucketed = y[:used].reshape(buckets, self.bucket_size)
+            stored = self._store(t[:used:self.bucket_size], bucketed.min(axis=1), bucketed.max(axis=1))
+            t, y = t[stored * len(bucketed[0]):], y[stored * len(bucketed[0]):]
+
+        if len(t):
+            self._pending = (t[0], y.min(), y.max(), len(t))
+
+    def view(self):
+        return self.t[:self.count], self.lo[:self.count], self.hi[:self.count]
+
+
+class Follower:
+    def __init__(self, filename, keys, capacity = 2048, chunk_rows = loader.DEFAULT_CHUNK_ROWS):
+        self.filename = filename
+        self.keys = list(keys)
+        self.chunk_rows = chunk_rows
+        self.last_rowid = 0
+        self.time_offset_us = 0
+        self.first = None       # first (normalized) sample of every key
+        self.series = {key: DecimatedSeries(capacity) for key in self.keys}
+
+    def poll(self):
+        # Reads only the rows that are new since the last call. Returns how many.
+        new_rows = 0
+        chunks = loader.readChunks(self.filename, set(self.keys) | {'period'}, normalize=False,
+                                   chunk_rows=self.chunk_rows, after_rowid=self.last_rowid)
+        for chunk in chunks:
+            self.last_rowid = int(chunk['rowid'][-1])
+            sample_time_us = np.cumsum(chunk['period']) + self.time_offset_us
+            self.time_offset_us = sample_time_us[-1]
+            sample_time_s = sample_time_us / 1000000
+            normalized = {key: data.TABLE_FORMAT[key].normalize(chunk[key]) for key in self.keys}
+            if self.first is None:
+                self.first = {key: column[0] for key, column in normalized.items()}
+            for key in self.keys:
+                self.series[key].extend(sample_time_s, normalized[key])
+            new_rows += len(chunk['rowid'])
+        return new_rows
+
+
+def run(filename, interval_s = 2.0, capacity = 2048):
+    import matplotlib.pyplot as plt
+
+    period_keys = ['period', 'period_estimate']
+    follower = Follower(filename, period_keys, capacity)
+
+    fig, ax1 = plt.subplots()
+    ax1.set_xlabel('Time [s]')
+    ax1.set_ylabel('Period per one Cycle [us]')
+    colors = {'period': 'green', 'period_estimate': 'red'}
+    labels = {'period': "Measured Period", 'period_estimate': "Estimated Period"}
+    lines = {}
+    for key in period_keys:
+        lines[key] = (ax1.plot([], [], colors[key], label=labels[key])[0],
+                      ax1.plot([], [], colors[key])[0])
+    ax1.legend()
+    plt.ion()
+    plt.show()
+
+    num_rows = 0
+    while plt.fignum_exists(fig.number):
+        with instrument.stage('poll'):
+            new_rows = follower.poll()
+        if new_rows:
+            with instrument.stage('update'):
+                num_rows += new_rows
+                # same as the static plot: estimate shifted onto the first measured period
+                initial_diff = follower.first['period'] - follower.first['period_estimate']
+                for key, (line_hi, line_lo) in lines.items():
+                    t, lo, hi = follower.series[key].view()
+                    shift = initial_diff if key == 'period_estimate' else 0
+                    line_hi.set_data(t, hi + shift)
+                    line_lo.set_data(t, lo + shift)
+                ax1.relim()
+                ax1.autoscale_view()
+                ax1.set_title(f"Estimation quality (live, {num_rows} samples, "
+                              f"{follower.series['period'].bucket_size} per point)")
+                fig.canvas.draw_idle()
+        plt.pause(interval_s)
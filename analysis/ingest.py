@@ -0,0 +1,252 @@
+import queue
+import sqlite3
+import threading
+import time
+import serial
+
+import data
+import instrument
+import telemetry
+
+# Serial -> SQLite ingestion.
+# A reader thread parses lines (or binary frames) from the device into rows and hands them over
+# through a bounded queue. The writer inserts them in batches, so a slow disk
+# never stalls reading from the device (and the USB CDC buffer never overflows).
+# Rows travel with the time they were read. The writer adds that, and the
+# cumulative reference time, as data.TIME_COLUMNS. When profiling (instrument.py)
+# it also records how long each row took until it was committed.
+
+STRINGCODE = 'ascii'
+DEVICE_COLUMN = 'Device'    # only in databases shared by several devices (see multilog.py)
+READER_JOIN_TIMEOUT_S = 3.0    # longer than a read (log.py: 1 s timeout)
+_PERIOD_INDEX = list(data.TABLE_FORMAT.keys()).index('period')
+
+def openDatabase(filename, device_column = False):
+    db = sqlite3.connect(filename)
+    # WAL: readers (plot.py, estimate.py) don't block us and we don't fsync per commit
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.execute("PRAGMA temp_store=MEMORY")
+    columns = [col.getSql() for col in data.COLUMNS.values()]
+    if device_column:
+        columns.append(f"'{DEVICE_COLUMN}' TEXT")
+    db.execute(f"CREATE TABLE IF NOT EXISTS {data.TABLE_NAME} ({', '.join(columns)})")
+    createTimeIndices(db)
+    if device_column:
+        db.execute(f"CREATE INDEX IF NOT EXISTS {data.TABLE_NAME}_device ON {data.TABLE_NAME} ('{DEVICE_COLUMN}')")
+    db.commit()
+    return db
+
+def createTimeIndices(db):
+    # for time windows (loader.Between)
+    for key, desc in data.TIME_COLUMNS.items():
+        db.execute(f"CREATE INDEX IF NOT EXISTS {data.TABLE_NAME}_{key} ON {data.TABLE_NAME} (\"{desc.name}\")")
+
+def parseValue(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def parseLine(line):
+    # Returns a row tuple, or None (with a reason printed) if the line is no sample.
+    elements = line.split(',')
+
+    if len(elements) == 0 or elements == ['']:
+        print (f"Got nothing. Is there a OSC LOCK?")
+        return None
+
+    if len(elements) < len(data.TABLE_FORMAT):
+        print (f"'{line}' is not of the expected format")
+        return None
+
+    if '[' in elements[0]:
+        print (f"Probably encountered header. Ignoring.")
+        return None
+
+    # TODO: Make sure that this the exact order of csv values -> database columns
+    try:
+        return tuple(parseValue(e) for e in elements[:len(data.TABLE_FORMAT)])
+    except ValueError:
+        print (f"'{line}' contains something that is not a number")
+        return None
+
+
+class SerialReader(threading.Thread):
+    # CSV lines, as printed by the firmware by default
+    def __init__(self, device, rows, parse = parseLine):
+        super().__init__(name="SerialReader", daemon=True)
+        self.device = device
+        self.rows = rows
+        self.parse = parse
+        self.dropped = 0
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def readRows(self):
+        raw = self.device.readline()
+        if not raw:
+            return []
+        row = self.parse(raw.decode(STRINGCODE, errors='replace').rstrip())
+        return [] if row is None else [row]
+
+    def statusText(self) -> str:
+        return f"dropped {self.dropped}"
+
+    def run(self):
+        try:
+            while self.device.is_open and not self._stop_event.is_set():
+                rows = self.readRows()
+                read_time = time.time()
+                for row in rows:
+                    try:
+                        self.rows.put_nowait((row, read_time))
+                    except queue.Full:
+                        self.dropped += 1
+        except serial.SerialException as e:
+            self.error = e
+        finally:
+            # wake up the writer, there is nothing more to come. Never wait for room:
+            # with a full queue, the writer notices we are gone once it ran dry.
+            try:
+                self.rows.put_nowait(None)
+            except queue.Full:
+                pass
+
+
+class FrameReader(SerialReader):
+    # Binary frames (config.hpp: binaryTelemetry), decoded in bulk
+    def __init__(self, device, rows):
+        super().__init__(device, rows)
+        self.decoder = telemetry.FrameDecoder()
+
+    def readRows(self):
+        # block for at least one frame, but take everything that is there
+        chunk = self.device.read(max(self.device.in_waiting, telemetry.FRAME_SIZE))
+        if not chunk:
+            return []
+        return telemetry.toRows(self.decoder.feed(chunk))
+
+    def statusText(self) -> str:
+        return f"dropped {self.dropped}, lost {self.decoder.lost}, corrupted {self.decoder.corrupted}"
+
+
+class DbWriter:
+    # device: tag for the Device column of a shared database, None if there is none
+    def __init__(self, db, batch_size = 256, flush_interval_s = 2.0, listeners = (), device = None):
+        self.db = db
+        self.device = device
+        # go on where the database ends, in case we append
+        self.reference_time_us = db.execute(
+            f"SELECT IFNULL(MAX(\"{data.TIME_COLUMNS['reference_time'].name}\"), 0) FROM {data.TABLE_NAME}"
+            + (f" WHERE \"{DEVICE_COLUMN}\" = ?" if device is not None else ""),
+            (device,) if device is not None else ()).fetchone()[0]
+        self.listeners = list(listeners)    # called with every written batch
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.batch = []
+        self.times = []     # (reference time, host time) of every row in the batch
+        self.num_rows = 0   # instead of asking SQLite with a COUNT (full scan)
+        self.last_row = None
+        self._last_flush = time.monotonic()
+        num_columns = len(data.COLUMNS) + (device is not None)
+        self._insert = f"INSERT INTO {data.TABLE_NAME} VALUES ({', '.join(['?'] * num_columns)})"
+
+    def add(self, row, read_time = None):
+        # read_time: host clock when the row came in (default: now)
+        self.batch.append(row)
+        self.reference_time_us += row[_PERIOD_INDEX]
+        self.times.append((self.reference_time_us, time.time() if read_time is None else read_time))
+        self.last_row = row
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flushIfDue(self):
+        if self.batch and time.monotonic() - self._last_flush >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            tag = () if self.device is None else (self.device,)
+            rows = [tuple(row) + times + tag for row, times in zip(self.batch, self.times)]
+            with instrument.stage('flush'):
+                with self.db:   # one transaction per batch
+                    self.db.executemany(self._insert, rows)
+            if instrument.PROFILER.enabled:
+                committed = time.time()
+                for _, read_time in self.times:
+                    instrument.sample('ingest latency [s]', committed - read_time)
+            self.times = []
+            self.num_rows += len(self.batch)
+            for listener in self.listeners:
+                listener(self.batch)
+            self.batch = []
+        self._last_flush = time.monotonic()
+
+
+class ThroughputReport:
+    def __init__(self, every_s = 2.0, calibration = None):
+        self.every_s = every_s
+        self.calibration = calibration
+        self._last_time = time.monotonic()
+        self._last_rows = 0
+
+    def due(self) -> bool:
+        return time.monotonic() - self._last_time >= self.every_s
+
+    def report(self, writer, rows, reader):
+        now = time.monotonic()
+        collected = writer.num_rows + len(writer.batch)
+        rate = (collected - self._last_rows) / (now - self._last_time)
+        instrument.PROFILER.counter('ingest', rows_per_s=rate, queued=rows.qsize())
+        print (f"\rCurrently collected {collected} samples ({rate:.1f}/s, queue {rows.qsize()}/{rows.maxsize}, {reader.statusText()}).", end=' ')
+        if writer.last_row is not None:
+            print (f" Current estimate diff: {writer.last_row[-1]} us", end=' ')
+        if self.calibration is not None:
+            print (f" Online fit: {self.calibration.summary()}", end=' ')
+        self._last_time = now
+        self._last_rows = collected
+
+
+def run(device, db, batch_size = 256, flush_interval_s = 2.0, queue_size = 4096, print_every_s = 2.0, binary = False,
+        calibration = None):
+    rows = queue.Queue(maxsize=queue_size)
+    reader = FrameReader(device, rows) if binary else SerialReader(device, rows)
+    listeners = [calibration.updateRows] if calibration else []
+    writer = DbWriter(db, batch_size, flush_interval_s, listeners)
+    report = ThroughputReport(print_every_s, calibration)
+    reader.start()
+    try:
+        while True:
+            try:
+                row = rows.get(timeout=flush_interval_s)
+            except queue.Empty:
+                if not reader.is_alive():
+                    break
+                row = ()
+            if row is None:
+                break
+            if row:
+                writer.add(*row)
+            writer.flushIfDue()
+            if report.due():
+                report.report(writer, rows, reader)
+    finally:
+        reader.stop()
+        # it stops after the current read, until then it may still be queueing
+        reader.join(READER_JOIN_TIMEOUT_S)
+        # whatever is still queued has been read from the device already
+        while True:
+            try:
+                row = rows.get_nowait()
+            except queue.Empty:
+                break
+            if row:
+                writer.add(*row)
+        writer.flush()
+    if reader.error:
+        raise reader.error
+    return writer.num_rows
@@ -0,0 +1,192 @@
+import json
+import math
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import cached_property
+
+# Where did the time go? Named stages with wall time, CPU time and memory,
+# written as a Chrome trace (chrome://tracing, ui.perfetto.dev) that also
+# carries a per-stage summary:
+#
+#   with instrument.stage('sweep'):
+#       ...
+#
+# Off by default, and then stage() costs next to nothing. On, it's some tens
+# of microseconds per stage, so it can stay on during long captures: stages that
+# repeat (flushes, redraws) are summed up, and only the first MAX_EVENTS make
+# it into the trace itself.
+#
+# Memory is what the kernel tells us: the RSS at the end of a stage and the
+# process' peak RSS so far (a stage that raised it set the peak). CPU time is
+# the whole process' (numpy's threads included), worker processes don't count.
+
+MAX_EVENTS = 100000
+_NOTHING = nullcontext()
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def currentRss() -> int:
+    # bytes, None where there is no /proc
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+def peakRss() -> int:
+    # bytes (ru_maxrss is KiB on Linux, bytes on macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+class Histogram:
+    # log-spaced, constant memory: for per-sample numbers like latencies
+    def __init__(self, lo = 1e-6, hi = 1e3, bins_per_decade = 10):
+        self.lo = lo
+        self.bins_per_decade = bins_per_decade
+        self.counts = [0] * (int(round(math.log10(hi / lo) * bins_per_decade)) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def add(self, value):
+        index = 0 if value < self.lo else min(int(math.log10(value / self.lo) * self.bins_per_decade) + 1,
+                                                len(self.counts) - 1)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def upperBound(self, index):
+        return self.lo * 10 ** (index / self.bins_per_decade)
+
+    def quantile(self, q):
+        # upper bound of the bin that holds the q-quantile
+        if not self.count:
+            return None
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(self.upperBound(index), self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.quantile(.5),
+            'p99': self.quantile(.99),
+            'max': self.max,
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.stages = {}
+        self.histograms = {}
+        self.dropped_events = 0
+        self._lock = threading.Lock()   # log.py has a reader thread
+        self._t0 = time.perf_counter()
+
+    def _event(self, event):
+        if len(self.events) < MAX_EVENTS:
+            self.events.append(event)
+        else:
+            self.dropped_events += 1
+
+    def stage(self, name, **args):
+        return self._stage(name, args) if self.enabled else _NOTHING
+
+    @contextmanager
+    def _stage(self, name, args):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_s, cpu_s = time.perf_counter() - wall, time.process_time() - cpu
+            rss, peak = currentRss(), peakRss()
+            with self._lock:
+                summary = self.stages.setdefault(name, {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'max_wall_s': 0.0})
+                summary['count'] += 1
+                summary['wall_s'] += wall_s
+                summary['cpu_s'] += cpu_s
+                summary['max_wall_s'] = max(summary['max_wall_s'], wall_s)
+                summary['rss_mb'] = rss / 2**20 if rss is not None else None
+                summary['peak_rss_mb'] = peak / 2**20
+                self._event({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                             'ts': (wall - self._t0) * 1e6, 'dur': wall_s * 1e6,
+                             'args': {'cpu_s': cpu_s, 'rss_mb': summary['rss_mb'], **args}})
+
+    def run(self, name, fn, *args, **kwargs):
+        with self.stage(name):
+            return fn(*args, **kwargs)
+
+    def sample(self, name, value):
+        # one value of a per-sample number, e.g. the ingest latency of a row
+        if self.enabled:
+            with self._lock:
+                self.histograms.setdefault(name, Histogram()).add(value)
+
+    def counter(self, name, **values):
+        # shows up as a graph in the trace
+        if self.enabled:
+            with self._lock:
+                self._event({'name': name, 'ph': 'C', 'pid': os.getpid(),
+                             'ts': (time.perf_counter() - self._t0) * 1e6, 'args': values})
+
+    def summary(self):
+        return {
+            'stages': self.stages,
+            'samples': {name: h.summary() for name, h in self.histograms.items()},
+            'peak_rss_mb': peakRss() / 2**20,
+            'dropped_events': self.dropped_events,
+        }
+
+    def write(self, filename):
+        # Chrome's JSON object format, which ignores the keys it doesn't know
+        with self._lock:
+            trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms', **self.summary()}
+        with open(filename, 'w') as f:
+            json.dump(trace, f, indent=1)
+
+    def report(self) -> str:
+        lines = [f"{'stage':>24} {'count':>7} {'wall [s]':>10} {'cpu [s]':>10} {'peak RSS [MB]':>14}"]
+        for name, s in self.stages.items():
+            lines.append(f"{name:>24} {s['count']:>7} {s['wall_s']:>10.3f} {s['cpu_s']:>10.3f} {s['peak_rss_mb']:>14.1f}")
+        for name, h in self.histograms.items():
+            s = h.summary()
+            if s['count']:
+                lines.append(f"{name}: {s['count']} samples, mean {s['mean']:.6f}, p50 <= {s['p50']:.6f}, "
+                             f"p99 <= {s['p99']:.6f}, max {s['max']:.6f}")
+        return "\n".join(lines)
+
+
+# one per process, like the scripts are
+PROFILER = Profiler()
+
+def enable():
+    PROFILER.enabled = True
+    return PROFILER
+
+def stage(name, **args):
+    return PROFILER.stage(name, **args)
+
+def run(name, fn, *args, **kwargs):
+    return PROFILER.run(name, fn, *args, **kwargs)
+
+def sample(name, value):
+    PROFILER.sample(name, value)
+
+
+class timedProperty(cached_property):
+    # cached_property whose (first) computation is a stage, named after the property
+    def __get__(self, instance, owner = None):
+        if instance is None:
+            return self
+        with PROFILER.stage(self.attrname):
+            return super().__get__(instance, owner)
@@ -0,0 +1,146 @@
+import numpy as np
+from scipy.signal import savgol_filter, find_peaks
+
+# Extrema-based phase latency between two curves.
+# Lives here (and not in estimate.py) so that sweep workers can import it.
+
+# In seconds of the run, not samples: how long a sample is depends on the fork
+# and periodsPerMeasurement (and on the grid, see resample.py). windowSamples()
+# makes samples out of them, per run.
+smooth_window_s = 50
+min_expected_peak_distance_s = 60
+NOMINAL_SAMPLE_SPACING_S = 1   # periodsPerMeasurement = expectedOscFreq, see config.hpp
+
+# what the results of the functions below depend on (e.g. for cache.py)
+def parameters():
+    return {'smooth_window_s': smooth_window_s, 'min_expected_peak_distance_s': min_expected_peak_distance_s}
+
+def windowSamples(seconds, sample_spacing_s = NOMINAL_SAMPLE_SPACING_S) -> int:
+    # savgol_filter and find_peaks want at least two
+    return max(2, int(round(seconds / sample_spacing_s)))
+
+def goodSavgolBecauseILookedAtItHard(x, window = None):
+    # window in samples, see windowSamples
+    return savgol_filter(x, window or windowSamples(smooth_window_s), 1)
+
+def getExtrema(thing, distance = None):
+    # distance in samples, see windowSamples
+    distance = distance or windowSamples(min_expected_peak_distance_s)
+    maxima = find_peaks(thing,
+                        distance=distance,
+                        width=distance)
+    minima = find_peaks(-thing, # negated!
+                        distance=distance,
+                        width=distance)
+    return (maxima[0], minima[0])
+
+def printExtrema(hansbob, name):
+    print (f"Found {len(hansbob[0])}, {len(hansbob[1])} extrema for {name}")
+    print (f"  First few maxima: {hansbob[0][:5]}")
+
+_NO_CLAMP = 1 << 40
+
+def _matchSegments(left_t, segment_starts, right_t, max_diff):
+    # Greedy matching of sorted left times against sorted right times, like a
+    # two-pointer walk: every left takes the first unused right that is not
+    # older than max_diff, if that one is also not newer than max_diff.
+    # `left_t` may hold several independent left lists back to back
+    # (starting at segment_starts); each one gets its own walk over right_t.
+    #
+    # The rights in the window of left l are [f_l, g_l). Walking the lefts, the
+    # ones neither taken nor too old are [p, g_l): a queue of s = g_l - p. Before
+    # left l, L_l = min(s_{l-1} + g_l - g_{l-1}, g_l - f_l) of them are there, and
+    # it takes the oldest one if L_l > 0. So
+    #   s_l = clip(s_{l-1} + (g_l - g_{l-1}) - 1, 0, g_l - f_l - 1)
+    # A shift followed by a clip, and those compose to a shift followed by a clip.
+    # So all s_l come from one prefix scan: log2(n) vectorized doubling steps.
+    num_left = len(left_t)
+    first = np.searchsorted(right_t, left_t - max_diff, side='left')
+    last = np.searchsorted(right_t, left_t + max_diff, side='right')
+    segment = np.zeros(num_left, dtype=np.int64)
+    segment[segment_starts[1:]] = 1
+    segment = np.cumsum(segment)
+    is_start = np.zeros(num_left, dtype=bool)
+    is_start[segment_starts] = True
+
+    arrived = last - np.where(is_start, 0, np.roll(last, 1))   # g_l - g_{l-1}
+    window = last - first
+    # l's step as x -> clip(x + shift, lo, hi), then composed with all before it in its segment
+    shift = arrived - 1
+    lo = np.zeros(num_left, dtype=np.int64)
+    hi = np.maximum(window - 1, 0)
+    index = np.arange(num_left)
+    distance = 1
+    while distance < num_left:
+        before = index - distance
+        valid = before >= 0
+        valid[valid] = segment[before[valid]] == segment[valid]
+        before = np.where(valid, before, 0)
+        shift_b = np.where(valid, shift[before], 0)
+        lo_b = np.where(valid, lo[before], -_NO_CLAMP)
+        hi_b = np.where(valid, hi[before], _NO_CLAMP)
+        shift, lo, hi = shift_b + shift, np.clip(lo_b + shift, lo, hi), np.clip(hi_b + shift, lo, hi)
+        distance *= 2
+    queued = np.clip(shift, lo, hi)     # s_l, starting from an empty queue
+
+    queued_before = np.where(is_start, 0, np.roll(queued, 1))
+    available = np.minimum(queued_before + arrived, window)
+    matched = available > 0
+    candidate = last - available
+    return candidate, matched, segment
+
+def correlateExtremaMany(lefts, right_i, sample_time, max_diff):
+    # Several left extrema lists (e.g. one per damp factor) against the same right one.
+    # Returns a list of (ret_l, ret_r, ret_diff), like correlateExtrema.
+    right_i = np.asarray(right_i, dtype=np.int64)
+    lefts = [np.asarray(left_i, dtype=np.int64) for left_i in lefts]
+    lengths = np.array([len(left_i) for left_i in lefts], dtype=np.int64)
+    if len(right_i) == 0 or lengths.sum() == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return [(empty, empty, np.empty(0)) for _ in lefts]
+
+    left_all = np.concatenate(lefts)
+    segment_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    nonempty_starts = segment_starts[lengths > 0]
+    candidate, matched, _ = _matchSegments(sample_time[left_all], nonempty_starts, sample_time[right_i], max_diff)
+
+    ret = []
+    for start, length in zip(segment_starts, lengths):
+        m = matched[start:start + length]
+        ret_l = left_all[start:start + length][m]
+        ret_r = right_i[candidate[start:start + length][m]]
+        ret.append((ret_l, ret_r, sample_time[ret_r] - sample_time[ret_l]))
+    return ret
+
+def correlateExtrema(left_i, right_i, sample_time, max_diff):
+    return correlateExtremaMany([left_i], right_i, sample_time, max_diff)[0]
+
+def correlateMinMax(left, right, time, max_diff_s):
+    left_max, right_max, diff_maxes = correlateExtrema(left[0], right[0], time, max_diff_s)
+    left_min, right_min, diff_mins = correlateExtrema(left[1], right[1], time, max_diff_s)
+    return ((left_max, left_min), (right_max, right_min), np.concatenate((diff_maxes, diff_mins)))
+
+def getPhaseLatencyMany(lefts, right, sample_time, window, right_extrema = None, distance = None):
+    # getPhaseLatency for many left curves, with the right extrema searched only once
+    if right_extrema is None:
+        right_extrema = getExtrema(right, distance)
+    left_extremas = [getExtrema(left, distance) for left in lefts]
+    maxes = correlateExtremaMany([e[0] for e in left_extremas], right_extrema[0], sample_time, window)
+    mins = correlateExtremaMany([e[1] for e in left_extremas], right_extrema[1], sample_time, window)
+    ret = []
+    for (left_max, right_max, diff_maxes), (left_min, right_min, diff_mins) in zip(maxes, mins):
+        common_time_diffs = np.concatenate((diff_maxes, diff_mins))
+        ret.append((common_time_diffs.mean() if len(common_time_diffs) else np.nan,
+                    (left_max, left_min), (right_max, right_min), common_time_diffs))
+    return ret
+
+def getPhaseLatency(left, right, sample_time, window, left_extrema = None, right_extrema = None, distance = None):
+    # extrema can be passed in if already known
+    if left_extrema is None:
+        left_extrema = getExtrema(left, distance)
+    # print (f"left: {left_extrema}")
+    if right_extrema is None:
+        right_extrema = getExtrema(right, distance)
+    # print (f"right: {right_extrema}")
+    common_temp_extrema, common_period_extrema, common_time_diffs = correlateMinMax(left_extrema, right_extrema, sample_time, window)
+    return (np.array(common_time_diffs).mean(), common_temp_extrema, common_period_extrema, common_time_diffs)
@@ -0,0 +1,188 @@
+import numpy as np
+import sqlite3 as sq
+from datetime import datetime
+
+import data
+
+# Chunked reading of the log table, so that we never need the whole
+# (possibly multi-GB) table as a pandas frame at once.
+# Columns are addressed by their key in data.COLUMNS.
+
+DEFAULT_CHUNK_ROWS = 1 << 16
+
+def dtypeOf(desc):
+    # fixed width type of a column, as stored (ColDesc.storage). Not the wire type of
+    # telemetry.py, that one is as small as it gets: a uint32 period would wrap in np.diff.
+    return np.dtype(desc.storage)
+
+def connect(filename):
+    return sq.connect(f"file:{filename}?mode=ro", uri=True)
+
+def _selectedKeys(keys):
+    if keys is None:
+        return list(data.TABLE_FORMAT.keys())
+    return list(keys)
+
+def hasColumns(filename, keys) -> bool:
+    con = connect(filename)
+    try:
+        names = {row[1] for row in con.execute(f"PRAGMA table_info({data.TABLE_NAME})")}
+    finally:
+        con.close()
+    return all(data.COLUMNS[key].name in names for key in keys)
+
+class Above:
+    # Plausibility filter that works in SQL and on already loaded columns
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+    def sql(self) -> str:
+        return f"\"{data.COLUMNS[self.key].name}\" > {self.value}"
+
+    def mask(self, columns):
+        return columns[self.key] > self.value
+
+    def __str__(self):
+        return f"{data.COLUMNS[self.key].name} > {self.value}"
+
+class Between:
+    # Time window on one of data.TIME_COLUMNS, lo <= t <= hi (None: open end).
+    # On the column itself (there is an index on it), not as a rowid range: in a
+    # shared database (multilog.py) the times of the devices interleave.
+    def __init__(self, key, lo = None, hi = None):
+        self.key = key
+        self.lo = lo
+        self.hi = hi
+
+    def sql(self) -> str:
+        name = f"\"{data.COLUMNS[self.key].name}\""
+        bounds = []
+        if self.lo is not None:
+            bounds.append(f"{name} >= {self.lo}")
+        if self.hi is not None:
+            bounds.append(f"{name} <= {self.hi}")
+        return " AND ".join(bounds) or "1"
+
+    def mask(self, columns):
+        column = columns[self.key]
+        ret = np.ones(len(column), dtype=bool)
+        if self.lo is not None:
+            ret &= column >= self.lo
+        if self.hi is not None:
+            ret &= column <= self.hi
+        return ret
+
+    def __str__(self):
+        return f"{self.lo} <= {data.COLUMNS[self.key].name} <= {self.hi}"
+
+# Cheap, row by row. Still used where rows come in chunk by chunk (online.py),
+# the analysis of a whole run uses clean.py instead.
+PLAUSIBILITY_FILTERS = [
+    Above('temperature', -6), # TODO: Better indication of a failed temperature measurement
+    Above('period', data.TABLE_FORMAT['period'].denormalize(2250)),    # Ugly AF. Should do a difference-between-samples instead
+]
+
+def _whereClause(filters):
+    if not filters:
+        return ""
+    return " AND " + " AND ".join(f"({f.sql() if hasattr(f, 'sql') else f})" for f in filters)
+
+def countRows(filename, filters = None) -> int:
+    con = connect(filename)
+    try:
+        return con.execute(f"SELECT COUNT(1) FROM {data.TABLE_NAME} WHERE 1{_whereClause(filters)}").fetchone()[0]
+    finally:
+        con.close()
+
+def readChunks(filename, keys = None, filters = None, normalize = True, chunk_rows = DEFAULT_CHUNK_ROWS, after_rowid = 0):
+    # Yields dicts {key: np.ndarray}, in rowid order, plus the 'rowid's themselves.
+    # Keyset pagination instead of OFFSET, so every chunk is an index range scan.
+    keys = _selectedKeys(keys)
+    descs = [data.COLUMNS[k] for k in keys]
+    columns = ", ".join(f"\"{d.name}\"" for d in descs)
+    query = (f"SELECT rowid, {columns} FROM {data.TABLE_NAME}"
+             f" WHERE rowid > ?{_whereClause(filters)} ORDER BY rowid LIMIT ?")
+
+    con = connect(filename)
+    try:
+        last_rowid = after_rowid
+        while True:
+            rows = con.execute(query, (last_rowid, chunk_rows)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            chunk = {'rowid': np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))}
+            for i, (key, desc) in enumerate(zip(keys, descs)):
+                raw = np.fromiter((row[i + 1] for row in rows),
+                                  dtype=dtypeOf(desc),
+                                  count=len(rows))
+                chunk[key] = desc.normalize(raw) if normalize else raw
+            yield chunk
+    finally:
+        con.close()
+
+def readColumns(filename, keys = None, filters = None, normalize = True, chunk_rows = DEFAULT_CHUNK_ROWS):
+    # Whole columns, but preallocated. So peak memory is only the projected
+    # columns plus one chunk, instead of the whole table twice.
+    keys = _selectedKeys(keys)
+    num_rows = countRows(filename, filters)
+    ret = {}
+    for key in keys:
+        desc = data.COLUMNS[key]
+        dtype = np.float64 if normalize else dtypeOf(desc)
+        ret[key] = np.empty(num_rows, dtype=dtype)
+
+    offset = 0
+    for chunk in readChunks(filename, keys, filters, normalize, chunk_rows):
+        # log.py may have appended rows since we counted: those are for the next read
+        length = min(len(chunk[keys[0]]), num_rows - offset)
+        for key in keys:
+            ret[key][offset:offset + length] = chunk[key][:length]
+        offset += length
+        if offset >= num_rows:
+            break
+    # and fewer, if some went away while we read
+    return {key: column[:offset] for key, column in ret.items()}
+
+def withSampleTime(chunks, period_key = 'period'):
+    # Cumulative reference time [s] carried across chunk borders.
+    # Expects raw (not normalized) periods, which are in us.
+    time_offset_us = 0
+    for chunk in chunks:
+        sample_time_us = np.cumsum(chunk[period_key]) + time_offset_us
+        if len(sample_time_us):
+            time_offset_us = sample_time_us[-1]
+        chunk['sample_time_s'] = sample_time_us / 1000000
+        yield chunk
+
+class NoTimeColumns(Exception):
+    pass
+
+def _maxTime(filename, key):
+    con = connect(filename)
+    try:
+        return con.execute(f"SELECT MAX(\"{data.COLUMNS[key].name}\") FROM {data.TABLE_NAME}").fetchone()[0] or 0
+    finally:
+        con.close()
+
+def timeFilters(filename, begin = None, end = None):
+    # --from/--to as filters. Each one is either seconds since the start of the run
+    # (reference time, negative: before its end) or an ISO date/time (host clock).
+    if begin is None and end is None:
+        return []
+    if not hasColumns(filename, data.TIME_COLUMNS):
+        raise NoTimeColumns(f"{filename} has no time columns yet, run migrate.py on it first.")
+    ret = []
+    for text, is_end in ((begin, False), (end, True)):
+        if text is None:
+            continue
+        try:
+            seconds = float(text)
+        except ValueError:
+            key, value = 'host_time', datetime.fromisoformat(text).timestamp()
+        else:
+            key = 'reference_time'
+            value = round(seconds * 1000000) + (_maxTime(filename, key) if seconds < 0 else 0)
+        ret.append(Between(key, hi=value) if is_end else Between(key, lo=value))
+    return ret
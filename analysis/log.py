@@ -1,57 +1,49 @@
 #!/usr/bin/python
-import sqlite3
 import serial
-from datetime import datetime, timedelta
+from argparse import ArgumentParser
+from datetime import datetime
 
 import data
-
-
-# TODO: Make parameter
-devicePath = '/dev/ttyACM0'
-stringcode = 'ascii'
-
-device = serial.Serial(devicePath, timeout=1)  # don't care for baudrate, is USB currently
+import ingest
+import instrument
+from online import OnlineCalibration
+
+
+parser = ArgumentParser(
+            prog='log.py',
+            description='Logs the measurements of the tuning fork clock into a sqlite database')
+
+parser.add_argument('device', nargs='?', default='/dev/ttyACM0')
+parser.add_argument('--batch-size', type=int, default=256, help='Rows per INSERT transaction')
+parser.add_argument('--flush-interval', type=float, default=2.0, help='Max. seconds before a partial batch is written')
+parser.add_argument('--binary', action='store_true', help='Device sends binary frames (binaryTelemetry in config.hpp)')
+parser.add_argument('--queue-size', type=int, default=4096, help='Rows buffered between serial reader and database writer')
+parser.add_argument('--online-fit', action='store_true', help='Keep fitting damped temperature vs. period while logging')
+parser.add_argument('--damp-factor', type=float, default=data.damp_factor, help='Damp factor for --online-fit')
+parser.add_argument('--profile', default=None,
+                    help='Write flush times and per-sample ingest latency there (JSON, Chrome trace format)')
+args = parser.parse_args()
+
+if args.profile:
+    instrument.enable()
+
+device = serial.Serial(args.device, timeout=1)  # don't care for baudrate, is USB currently
 assert(device.is_open)
 
 db_file_name = datetime.today().strftime('%Y-%m-%d_%H-%M-%S') + "_sensor_log.db"
-db = sqlite3.connect(db_file_name)
-db_con = db.cursor()
-
-db_con.execute(f"CREATE TABLE {data.TABLE_NAME} ({', '.join([col.getSql() for col in data.TABLE_FORMAT.values()])})")
-db.commit()
-
-PRINT_EVERY = timedelta(seconds=2)
-lastprint = datetime.fromtimestamp(0)
+db = ingest.openDatabase(db_file_name)
 
 print (f"Writing into '{db_file_name}'")
 
-try:
-    while (device.is_open):
-        line = device.readline().decode(stringcode).rstrip()
-        # print (line)
-        elements = line.split(',')
+calibration = OnlineCalibration(args.damp_factor) if args.online_fit else None
 
-        if len(elements) == 0:
-            print (f"Got nothing. Is there a OSC LOCK?")
-            continue
-
-        if len(elements) < len(data.TABLE_FORMAT):
-            print (f"'{line}' is not of the expected format")
-            continue
-
-        if '[' in elements[0]:
-            print (f"Probably encountered header. Ignoring.")
-            continue
-
-        # TODO: Make sure that this the exact order of csv values -> database columns
-        db_con.execute(f"INSERT INTO {data.TABLE_NAME} VALUES ({', '.join(elements[:len(data.TABLE_FORMAT)])})")
-
-        if datetime.now() > lastprint + PRINT_EVERY:
-            numrows = db_con.execute(f"SELECT COUNT(1) from {data.TABLE_NAME}").fetchone()[0]
-            print (f"\rCurrently collected {numrows} samples.", end=' ')
-            print (f" Current estimate diff: {elements[-1]} us", end=' ')
-            db.commit()  # Also, commit while we are at it
-            lastprint = datetime.now()
+try:
+    ingest.run(device, db,
+               batch_size=args.batch_size,
+               flush_interval_s=args.flush_interval,
+               queue_size=args.queue_size,
+               binary=args.binary,
+               calibration=calibration)
 except KeyboardInterrupt:
     print("Exceptional stuff")
     pass
@@ -61,5 +53,11 @@ except serial.SerialException:
 print (f"Committing db as {db_file_name}...")
 db.commit()
 db.close()
+if calibration and calibration.fit.ready():
+    print (f"Online fit on damped data ({args.damp_factor}): {calibration.summary()}")
+    print ("Covariance of fit:")
+    print (calibration.fit.covariance())
+if args.profile:
+    instrument.PROFILER.write(args.profile)
+    print (f"{instrument.PROFILER.report()}\nProfile in {args.profile}")
 print ("done.")
-
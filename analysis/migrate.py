@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+import os
+import re
+import sqlite3
+from argparse import ArgumentParser
+from datetime import datetime
+
+import data
+import ingest
+
+# Adds the columns newer loggers write (data.TIME_COLUMNS) to older databases:
+#
+#   ReferenceTime   cumulative Period, exactly what log.py would have written
+#   HostTime        estimated: the start time from the file name (log.py puts it
+#                   there), or the file's mtime as the end of the run, plus the
+#                   reference time. Only as good as the host's and the fork's clocks.
+#
+# Shared databases (multilog.py) are summed up per device. One transaction, so
+# a database is either migrated or not.
+
+START_PATTERN = re.compile(r'(\d{4}-\d\d-\d\d_\d\d-\d\d-\d\d)')
+
+def startTime(filename, duration_s):
+    # (unix time of the first sample, where that came from)
+    match = START_PATTERN.search(os.path.basename(filename))
+    if match:
+        return datetime.strptime(match.group(1), '%Y-%m-%d_%H-%M-%S').timestamp(), "file name"
+    return os.stat(filename).st_mtime - duration_s, "modification time"
+
+def columnNames(db):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({data.TABLE_NAME})")}
+
+def migrate(filename):
+    # -> None if there was nothing to do, otherwise where the host time came from
+    db = sqlite3.connect(filename)
+    try:
+        names = columnNames(db)
+        missing = [desc for desc in data.TIME_COLUMNS.values() if desc.name not in names]
+        if not missing:
+            return None
+        reference_time = f"\"{data.TIME_COLUMNS['reference_time'].name}\""
+        host_time = f"\"{data.TIME_COLUMNS['host_time'].name}\""
+        period = f"\"{data.TABLE_FORMAT['period'].name}\""
+        partition = f"PARTITION BY \"{ingest.DEVICE_COLUMN}\" " if ingest.DEVICE_COLUMN in names else ""
+        with db:
+            for desc in missing:
+                db.execute(f"ALTER TABLE {data.TABLE_NAME} ADD COLUMN {desc.getSql()}")
+            db.execute(f"WITH t AS (SELECT rowid AS r, SUM({period}) OVER ({partition}ORDER BY rowid) AS s "
+                       f"FROM {data.TABLE_NAME}) "
+                       f"UPDATE {data.TABLE_NAME} SET {reference_time} = t.s FROM t WHERE t.r = {data.TABLE_NAME}.rowid")
+            duration_s = (db.execute(f"SELECT MAX({reference_time}) FROM {data.TABLE_NAME}").fetchone()[0] or 0) / 1000000
+            start, source = startTime(filename, duration_s)
+            db.execute(f"UPDATE {data.TABLE_NAME} SET {host_time} = ? + {reference_time} / 1000000.0", (start,))
+            ingest.createTimeIndices(db)
+        return source
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='migrate.py',
+                description='Adds the reference and host time columns to older sensor log databases')
+    parser.add_argument('database', nargs='+')
+    args = parser.parse_args()
+
+    for db_filename in args.database:
+        source = migrate(db_filename)
+        if source is None:
+            print (f"{db_filename} is up to date")
+        else:
+            print (f"Migrated {db_filename} (host time from the {source})")
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+
+import asyncio
+import os
+import sqlite3
+import time
+import serial
+from argparse import ArgumentParser
+from datetime import datetime
+
+import data
+import ingest
+import telemetry
+
+# log.py for several clocks in the same climate chamber, in one process.
+# Every device gets a non-blocking asyncio stream reader, the rows of all of
+# them go through one queue to the writers, either
+#
+#   per device:  <time>_<device>_sensor_log.db, same as log.py writes (default)
+#   shared:      <time>_multi_sensor_log.db, one WAL database with a Device column
+#
+#   ./multilog.py fork_a=/dev/ttyACM0 fork_b=/dev/ttyACM1 --shared
+#
+# A shared database can be split up afterwards (--split), everything else
+# (estimate.py, plot.py, ...) expects one device per database.
+
+READ_SIZE = 1 << 12
+
+def parseDevice(text):
+    # '[id=]path' -> (id, path), the id defaults to the name of the device
+    device_id, _, path = text.rpartition('=')
+    return device_id or os.path.basename(path), path
+
+async def openStream(path):
+    # pyserial sets up the port (raw, no echo), asyncio does the reading
+    device = serial.Serial(path, timeout=0)
+    reader = asyncio.StreamReader(limit=1 << 16)
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), device)
+    return reader
+
+
+class DeviceReader:
+    # one device, CSV lines or binary frames -> (device id, row, read time) into the queue
+    def __init__(self, device_id, stream, rows, binary = False):
+        self.device_id = device_id
+        self.stream = stream
+        self.rows = rows
+        self.decoder = telemetry.FrameDecoder() if binary else None
+        self.received = 0
+        self.error = None
+
+    async def readRows(self):
+        # [] at the end of the stream, [()] if there was nothing useful
+        if self.decoder is not None:
+            chunk = await self.stream.read(READ_SIZE)
+            return telemetry.toRows(self.decoder.feed(chunk)) or [()] if chunk else []
+        line = await self.stream.readline()
+        if not line:
+            return []
+        row = ingest.parseLine(line.decode(ingest.STRINGCODE, errors='replace').rstrip())
+        return [()] if row is None else [row]
+
+    async def run(self):
+        try:
+            while rows := await self.readRows():
+                read_time = time.time()
+                for row in filter(None, rows):
+                    self.received += 1
+                    # waiting here is fine, unlike in ingest.SerialReader: the stream
+                    # stops reading, and the rest waits in the kernel's buffer
+                    await self.rows.put((self.device_id, row, read_time))
+        except (OSError, serial.SerialException) as e:
+            # e.g. the port went away mid-read. A plain hang up is just the end of the stream.
+            self.error = e
+
+    def statusText(self) -> str:
+        ret = f"{self.device_id}: {self.received}"
+        if self.decoder is not None and (self.decoder.lost or self.decoder.corrupted):
+            ret += f", lost {self.decoder.lost}, corrupted {self.decoder.corrupted}"
+        return ret
+
+
+def openWriters(device_ids, shared = None, prefix = None, batch_size = 256, flush_interval_s = 2.0):
+    # -> ({device id: DbWriter}, [database filenames]). shared: filename of the one database for all.
+    prefix = prefix or datetime.today().strftime('%Y-%m-%d_%H-%M-%S')
+    if shared:
+        db = ingest.openDatabase(shared, device_column=True)
+        return {d: ingest.DbWriter(db, batch_size, flush_interval_s, device=d) for d in device_ids}, [shared]
+    writers, filenames = {}, []
+    for device_id in device_ids:
+        filenames.append(f"{prefix}_{device_id}_sensor_log.db")
+        writers[device_id] = ingest.DbWriter(ingest.openDatabase(filenames[-1]), batch_size, flush_interval_s)
+    return writers, filenames
+
+async def writeRows(rows, writers, flush_interval_s = 2.0, print_every_s = 2.0, readers = ()):
+    # Until a None comes. SQLite blocks the loop for a batch, but that's milliseconds;
+    # meanwhile the kernel buffers the serial ports.
+    last_report = time.monotonic()
+    while True:
+        try:
+            item = await asyncio.wait_for(rows.get(), flush_interval_s)
+        except asyncio.TimeoutError:
+            item = ()
+        if item is None:
+            break
+        if item:
+            device_id, row, read_time = item
+            writers[device_id].add(row, read_time)
+        for writer in writers.values():
+            writer.flushIfDue()
+        if readers and time.monotonic() - last_report >= print_every_s:
+            print (f"\rCollected {', '.join(r.statusText() for r in readers)}, queue {rows.qsize()}.", end=' ')
+            last_report = time.monotonic()
+
+async def logDevices(devices, writers, binary = False, queue_size = 4096, flush_interval_s = 2.0, print_every_s = 2.0):
+    # devices: {id: path}. Runs until every device is gone (or we get cancelled).
+    rows = asyncio.Queue(maxsize=queue_size)
+    readers = [DeviceReader(device_id, await openStream(path), rows, binary) for device_id, path in devices.items()]
+    writer = asyncio.create_task(writeRows(rows, writers, flush_interval_s, print_every_s, readers))
+    try:
+        await asyncio.gather(*(reader.run() for reader in readers))
+        await rows.put(None)
+        await writer
+    finally:
+        writer.cancel()
+        # whatever is still queued has been read from the devices already
+        while not rows.empty():
+            item = rows.get_nowait()
+            if item:
+                writers[item[0]].add(*item[1:])
+        for w in writers.values():
+            w.flush()
+    return readers
+
+
+def splitDatabase(filename, prefix = None):
+    # shared database -> one per device, in the layout log.py writes
+    prefix = prefix or os.path.splitext(filename)[0].removesuffix('_multi_sensor_log')
+    db = sqlite3.connect(filename)
+    device_ids = [d for (d,) in db.execute(f"SELECT DISTINCT \"{ingest.DEVICE_COLUMN}\" FROM {data.TABLE_NAME}")]
+    # older shared databases have no time columns (migrate.py adds them)
+    names = {row[1] for row in db.execute(f"PRAGMA table_info({data.TABLE_NAME})")}
+    columns = ', '.join(f'"{col.name}"' for col in data.COLUMNS.values() if col.name in names)
+    filenames = []
+    for device_id in device_ids:
+        filenames.append(f"{prefix}_{device_id}_sensor_log.db")
+        ingest.openDatabase(filenames[-1]).close()
+        db.execute("ATTACH DATABASE ? AS part", (filenames[-1],))
+        with db:
+            db.execute(f"INSERT INTO part.{data.TABLE_NAME} ({columns}) SELECT {columns} FROM {data.TABLE_NAME} "
+                       f"WHERE \"{ingest.DEVICE_COLUMN}\" = ? ORDER BY rowid", (device_id,))
+        db.execute("DETACH DATABASE part")
+    db.close()
+    return filenames
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='multilog.py',
+                description='Logs the measurements of several tuning fork clocks at once')
+    parser.add_argument('devices', nargs='*', help='[id=]path, e.g. fork_a=/dev/ttyACM0')
+    parser.add_argument('--shared', action='store_true', help='One database with a Device column instead of one per device')
+    parser.add_argument('--split', default=None, help='Split this shared database into one per device, and exit')
+    parser.add_argument('--batch-size', type=int, default=256, help='Rows per INSERT transaction')
+    parser.add_argument('--flush-interval', type=float, default=2.0, help='Max. seconds before a partial batch is written')
+    parser.add_argument('--binary', action='store_true', help='Devices send binary frames (binaryTelemetry in config.hpp)')
+    parser.add_argument('--queue-size', type=int, default=4096, help='Rows buffered between the readers and the writers')
+    args = parser.parse_args()
+
+    if args.split:
+        for filename in splitDatabase(args.split):
+            print (f"Wrote {filename}")
+        exit()
+    if not args.devices:
+        parser.error("no devices given")
+
+    devices = dict(parseDevice(d) for d in args.devices)
+    if len(devices) < len(args.devices):
+        parser.error("device ids have to be unique")
+    prefix = datetime.today().strftime('%Y-%m-%d_%H-%M-%S')
+    writers, filenames = openWriters(devices, prefix + "_multi_sensor_log.db" if args.shared else None, prefix,
+                                     args.batch_size, args.flush_interval)
+    print (f"Writing into {', '.join(repr(f) for f in filenames)}")
+
+    try:
+        readers = asyncio.run(logDevices(devices, writers, args.binary, args.queue_size, args.flush_interval))
+        for reader in readers:
+            if reader.error:
+                print (f"\n{reader.device_id}: Disco! (disco who?) Disconnected! ({reader.error})")
+    except KeyboardInterrupt:
+        print ("Exceptional stuff")
+    except serial.SerialException as e:
+        print (f"Could not open a device: {e}")
+
+    print (f"Committing {', '.join(filenames)}...")
+    for db in {w.db for w in writers.values()}:
+        db.commit()
+        db.close()
+    print ("done.")
@@ -0,0 +1,150 @@
+#!/usr/bin/python
+
+import numpy as np
+from numpy.polynomial import Polynomial
+from argparse import ArgumentParser
+
+import data
+import loader
+from damper import Damper
+
+# Online version of estimate.py's fit(): keeps the sums of the normal
+# equations, so every new sample costs O(order^2) and the current coefficients
+# (and their covariance) are available at any time without rescanning the run.
+
+class OnlinePolyFit:
+    def __init__(self, order = 2, x_scale = 100, x_offset = None, y_offset = None):
+        self.order = order
+        self.x_scale = x_scale      # 100 centidegrees: keeps x^(2*order) small
+        self.x_offset = x_offset    # default: the first sample. Shifting does not
+        self.y_offset = y_offset    # change the fit, but the conditioning a lot.
+        self.count = 0
+        self.xtx = np.zeros((order + 1, order + 1))
+        self.xty = np.zeros(order + 1)
+        self.yty = 0.0
+
+    def _powers(self, xs):
+        u = (np.asarray(xs, dtype=np.float64) - self.x_offset) / self.x_scale
+        return np.vander(u, self.order + 1, increasing=True)
+
+    def addMany(self, xs, ys):
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if len(xs) == 0:
+            return
+        if self.x_offset is None:
+            self.x_offset = xs[0]
+        if self.y_offset is None:
+            self.y_offset = ys[0]
+        a = self._powers(xs)
+        v = ys - self.y_offset
+        self.xtx += a.T @ a
+        self.xty += a.T @ v
+        self.yty += v @ v
+        self.count += len(xs)
+
+    def add(self, x, y):
+        self.addMany([x], [y])
+
+    def merge(self, other):
+        # e.g. for several chunks/workers/runs. Offsets have to match, so pass them
+        # to the constructor if the parts are not fed from the same first sample.
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.x_offset, self.y_offset = other.x_offset, other.y_offset
+        assert (self.x_offset, self.y_offset, self.x_scale) == (other.x_offset, other.y_offset, other.x_scale)
+        self.xtx += other.xtx
+        self.xty += other.xty
+        self.yty += other.yty
+        self.count += other.count
+
+    def enoughSamples(self) -> bool:
+        return self.count > self.order + 1
+
+    def ready(self) -> bool:
+        # and enough different temperatures for every coefficient: a stable run has
+        # a flat one at first, and then the normal equations are singular
+        return self.enoughSamples() and np.linalg.matrix_rank(self.xtx) == self.order + 1
+
+    def _solveScaled(self):
+        beta = np.linalg.solve(self.xtx, self.xty)
+        rss = max(self.yty - 2 * beta @ self.xty + beta @ self.xtx @ beta, 0)
+        # same scaling as np.polyfit(..., cov=True)
+        cov = np.linalg.inv(self.xtx) * rss / (self.count - (self.order + 1))
+        return beta, cov
+
+    def _toRaw(self):
+        # column k: raw coefficients of ((x - x_offset) / x_scale)^k
+        u = Polynomial([-self.x_offset / self.x_scale, 1 / self.x_scale])
+        transform = np.zeros((self.order + 1, self.order + 1))
+        for k in range(self.order + 1):
+            coef = (u ** k).coef
+            transform[:len(coef), k] = coef
+        return transform
+
+    def coefficients(self):
+        # Lowest order first, like temperatureCalibrationPolynom in config.hpp
+        beta, _ = self._solveScaled()
+        raw = self._toRaw() @ beta
+        raw[0] += self.y_offset
+        return raw
+
+    def covariance(self):
+        # Of coefficients(), same order
+        _, cov = self._solveScaled()
+        transform = self._toRaw()
+        return transform @ cov @ transform.T
+
+    def asPoly1d(self):
+        return np.poly1d(self.coefficients()[::-1])
+
+
+class OnlineCalibration:
+    # Damped temperature vs. period, fed with raw values chunk by chunk
+    def __init__(self, damp_factor = data.damp_factor, order = 2, filters = None):
+        self.damper = Damper(damp_factor)
+        self.fit = OnlinePolyFit(order)
+        self.filters = filters if filters is not None else loader.PLAUSIBILITY_FILTERS
+
+    def update(self, columns):
+        # columns: {'period': raw, 'temperature': raw}
+        mask = np.logical_and.reduce([f.mask(columns) for f in self.filters]) if self.filters else slice(None)
+        temp = np.asarray(columns['temperature'])[mask]
+        period = np.asarray(columns['period'])[mask]
+        self.fit.addMany(self.damper.consume(temp), period)
+
+    def updateRows(self, rows):
+        # rows as inserted into the database (TABLE_FORMAT order)
+        if not rows:
+            return
+        keys = list(data.TABLE_FORMAT.keys())
+        table = np.asarray(rows, dtype=np.float64)
+        self.update({key: table[:, keys.index(key)] for key in ('period', 'temperature')})
+
+    def summary(self) -> str:
+        if not self.fit.enoughSamples():
+            return f"{self.fit.count} samples, not enough for a fit"
+        if not self.fit.ready():
+            return f"{self.fit.count} samples, not enough temperature spread for a fit yet"
+        return "f(x) = " + " + ".join([f'{f}x^{i}' for i, f in enumerate(self.fit.coefficients())])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='online.py',
+                description='Fits damped temperature vs. period by streaming over a sensor log database')
+    parser.add_argument('database')
+    parser.add_argument('--damp-factor', type=float, default=data.damp_factor)
+    parser.add_argument('--order', type=int, default=2)
+    args = parser.parse_args()
+
+    calibration = OnlineCalibration(args.damp_factor, args.order)
+    for chunk in loader.readChunks(args.database, ['period', 'temperature'], normalize=False):
+        calibration.update(chunk)
+
+    print (f"On damped data ({args.damp_factor}), {calibration.fit.count} samples:")
+    print (f"**\nFactors of best fit: {calibration.summary()}\n**")
+    if calibration.fit.ready():
+        print ("Covariance of fit:")
+        print (calibration.fit.covariance())
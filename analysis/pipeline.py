@@ -0,0 +1,368 @@
+import numpy as np
+
+import data
+import aggregate
+import archive
+import cache
+import clean
+import fitting
+import instrument
+from instrument import timedProperty
+import latency
+import resample
+from damper import dampen, dampenMany
+from latency import goodSavgolBecauseILookedAtItHard, getExtrema, getPhaseLatency
+from sweep import sweep, ENGINES
+from xcorr import getCrossCorrelationLatency
+
+# What estimate.py does, as a library. Every stage is a plain function with
+# explicit inputs and outputs. `Run` wires them together lazily, so only the
+# stages an output depends on are computed:
+#
+#   run = Run('2024-01-01_12-00-00_sensor_log.db', damp_factor=0.0023)
+#   run.damped_fit          # loads and fits. No smoothing, no sweep.
+#
+# Nothing in here prints, plots or exits.
+
+LATENCY_WINDOW_S = 800  # probably_not_slower_than, seconds of the reference clock like sample_time_s
+SWEEP_STEPS = 8
+SCALED_INTEREST_BOUNDS = (.01, .001)   # Hm, less manual please
+FIT_DEGREE = 2  # We expect a linear relationship, but let's add another degree
+SECONDS_PER_DAY = 24 * 60 * 60
+
+class NoZeroCrossing(Exception):
+    pass
+
+
+def loadColumns(filename, keys = clean.KEYS, filters = None) -> dict:
+    # Only what we actually calculate with (and clean with), and raw (not normalized).
+    # Comes from the memory-mapped archive, if there is an up-to-date one.
+    # filters: e.g. a time window, see loader.timeFilters
+    return archive.load(filename, keys, filters, normalize=False)
+
+def cleanColumns(columns, mode = 'interpolate'):
+    # -> ({'period', 'temperature'}, quality report, measured mask). See clean.py
+    cleaned, report = clean.clean(columns, mode)
+    return {key: cleaned[key] for key in ('period', 'temperature')}, report, cleaned['measured']
+
+def resampleColumns(columns, sample_time_us, rate_hz, measured = None):
+    # -> (columns on a uniform grid, weights, grid time in us). See resample.py
+    return resample.resample(columns, sample_time_us, 1000000 / rate_hz, measured)
+
+def moments(columns) -> aggregate.Covariance:
+    # chunk by chunk, see aggregate.py
+    return aggregate.feed(aggregate.Covariance(columns.keys()), columns)
+
+def covariance(columns):
+    return moments(columns).covariance()
+
+def sampleTime(period):
+    return np.cumsum(np.array(period))
+
+def windows(sample_spacing_s):
+    # (smoothing window, peak distance) in samples, from the ones in seconds in latency.py
+    return (latency.windowSamples(latency.smooth_window_s, sample_spacing_s),
+            latency.windowSamples(latency.min_expected_peak_distance_s, sample_spacing_s))
+
+def smooth(temp, period, window = None):
+    return goodSavgolBecauseILookedAtItHard(temp, window), goodSavgolBecauseILookedAtItHard(period, window)
+
+def extrema(temp_smooth, period_smooth, distance = None):
+    return getExtrema(temp_smooth, distance), getExtrema(period_smooth, distance)
+
+def phaseLatency(temp_smooth, period_smooth, sample_time_s, window, temp_extrema, period_extrema):
+    # (mean latency, common temp extrema, common period extrema, time diffs)
+    # I think that if time and period are smoothed by the same amount,
+    # then the average time difference is not affected by the smoothing?
+    return getPhaseLatency(temp_smooth, period_smooth, sample_time_s, window,
+                           left_extrema=temp_extrema, right_extrema=period_extrema)
+
+def sweepFactors(steps, bounds = SCALED_INTEREST_BOUNDS):
+    # (linear position in [0, 1], factor) for each candidate, denser at the low end
+    lin_fs = [1 * ((i+1) / steps) for i in range(0, steps)]
+    return lin_fs, [min(bounds) + max(bounds) * pow(lin_f, 3) for lin_f in lin_fs]
+
+def crossCorrelationLatency(temp, period, sample_time_s, window):
+    # the latency from the cross-correlation, no smoothing or extrema needed
+    return getCrossCorrelationLatency(temp, period, sample_time_s, window)
+
+def dampSweep(temp, period, sample_time_s, window, factors, workers = None, period_extrema = None,
+              engine = 'extrema', peak_distance = None, time_delta = None):
+    # Coarse pass over all factors, then Brent on every bracket. All in worker processes.
+    # The period smoothed for the extrema engine, raw for xcorr.
+    return sweep(temp, period, sample_time_s, window, factors, workers=workers,
+                 period_extrema=period_extrema, engine=engine, peak_distance=peak_distance, time_delta=time_delta)
+
+def bestDampFactor(sweep_result) -> float:
+    # The first crossing; raises if there is none. Check the sweep plot if there are several!
+    if not sweep_result.roots:
+        raise NoZeroCrossing("We did not find any zero crossing of best factor fit!")
+    return sweep_result.roots[0]
+
+
+def fitDegree(x, y, weights = None, max_degree = fitting.MAX_DEGREE) -> int:
+    # lowest degree that predicts held out stretches of the run (about) as well as any
+    return fitting.crossValidate(x, y, max_degree, weights)[0]
+
+
+class Fit:
+    # Same interface as np.polyfit + np.poly1d had, but computed conditioned (see fitting.py)
+    def __init__(self, x, y, order, weights = None):
+        self._setConditioned(fitting.fit(x, y, order, weights))
+
+    @classmethod
+    def fromSums(cls, sums):
+        # e.g. the merged fitting.NormalSums of several runs
+        ret = cls.__new__(cls)
+        ret._setConditioned(fitting.ConditionedFit(sums))
+        return ret
+
+    def _setConditioned(self, conditioned):
+        self.conditioned = conditioned
+        self.coefficients = self.conditioned.power()[::-1]
+        self.covariance = self.conditioned.powerCovariance()[::-1, ::-1]
+        self.poly = np.poly1d(self.coefficients)
+
+    def __call__(self, x):
+        return self.conditioned(x)
+
+    def cpp(self) -> str:
+        return self.conditioned.cpp()
+
+    def asFunction(self) -> str:
+        return "f(x) = " + " + ".join([f'{f}x^{i}' for i, f in enumerate(reversed(self.coefficients))])
+
+
+class Deviation:
+    def __init__(self, thing, sample_mean = None):
+        thing_moments = moments({'thing': thing})
+        self.std, self.mean = (thing_moments.std('thing'), thing_moments.mean[0])
+        if not sample_mean:
+            # this is if we apply a difference, which is of course offset to an absolute value
+            sample_mean = self.mean
+        self.seconds_per_day = self.std * SECONDS_PER_DAY / sample_mean
+
+
+class Stats:
+    # How well a fit would have predicted the period. The drift weighted like the fit
+    # (weights: measured samples per step, see Run.resampled), otherwise the sum of
+    # the residuals is not the one the fit made vanish.
+    def __init__(self, estimated_period, period, uncorrected, avg_duration_of_sample_us, weights = None):
+        self.estimated_period = estimated_period
+        self.difference = estimated_period - period
+        self.corrected = Deviation(self.difference, sample_mean=np.mean(period))
+        self.improvement_ratio = uncorrected.std / self.corrected.std
+        if weights is None:
+            self.drift = aggregate.feed(aggregate.Drift(), {'difference': self.difference})
+        else:
+            self.drift = aggregate.feed(aggregate.Drift(weight_key='weight'),
+                                        {'difference': self.difference, 'weight': weights})
+        # avg_duration_of_sample_us: per unit of weight, if weighted
+        self.drift_s = self.drift.seconds(avg_duration_of_sample_us)
+
+
+class Run:
+    # One database, all stages. Pass damp_factor to skip latency and sweep.
+    def __init__(self, filename, cleaning = 'interpolate', window = LATENCY_WINDOW_S, sweep_steps = SWEEP_STEPS,
+                 workers = None, damp_factor = None, fit_degree = FIT_DEGREE, use_cache = True, engine = 'extrema',
+                 time_filters = (), resample_hz = None):
+        # fit_degree None: cross-validated on the damped data. engine: of the latency, see sweep.ENGINES
+        # time_filters: only part of the run, see loader.timeFilters
+        # resample_hz: everything after the cleaning on a uniform grid of that rate, see resample.py
+        self.filename = filename
+        self.cleaning = cleaning
+        self.window = window
+        self.sweep_steps = sweep_steps
+        self.workers = workers
+        self.fixed_damp_factor = damp_factor
+        self.fit_degree = fit_degree
+        self.use_cache = use_cache
+        self.engine = engine
+        self.time_filters = list(time_filters)
+        self.resample_hz = resample_hz
+
+    @timedProperty
+    def cleaned(self):
+        with instrument.stage('load'):
+            columns = loadColumns(self.filename, filters=self.time_filters)
+        return cleanColumns(columns, self.cleaning)
+
+    @timedProperty
+    def reference_time_us(self):
+        # end of every (cleaned) sample, by the reference clock
+        return self._derived('sample_time_us', lambda: sampleTime(self.cleaned[0]['period']))
+
+    @timedProperty
+    def resampled(self):
+        # (columns, weights, sample time in us) that everything below works on
+        columns, _, measured = self.cleaned
+        if not self.resample_hz:
+            # interpolated and inserted samples don't get a say in the fit
+            return columns, measured.astype(np.float64), self.reference_time_us
+        return resampleColumns(columns, self.reference_time_us, self.resample_hz, measured)
+
+    @property
+    def columns(self):
+        return self.resampled[0]
+
+    @property
+    def quality(self):
+        return self.cleaned[1]
+
+    @property
+    def weights(self):
+        return self.resampled[1]
+
+    @property
+    def period(self):
+        return self.columns['period']
+
+    @property
+    def temp(self):
+        return self.columns['temperature']
+
+    @timedProperty
+    def moments(self):
+        return moments(self.columns)
+
+    @property
+    def covariance(self):
+        return self.moments.covariance()
+
+    @timedProperty
+    def histogram(self):
+        # temperature vs. period, fixed bins (see aggregate.py)
+        return aggregate.feed(aggregate.Histogram2d(), self.columns)
+
+    @timedProperty
+    def derived(self):
+        return cache.DerivedCache(self.filename, enabled=self.use_cache)
+
+    def _derived(self, name, compute):
+        params = {'cleaning': clean.parameters(self.cleaning), **latency.parameters()}
+        if self.time_filters:
+            params['time'] = [str(f) for f in self.time_filters]
+        if self.resample_hz:
+            params['resample_hz'] = self.resample_hz
+        return self.derived.get(name, params, compute)
+
+    @property
+    def sample_time_us(self):
+        return self.resampled[2]
+
+    @timedProperty
+    def sample_time_s(self):
+        return self.sample_time_us / 1000000
+
+    @property
+    def duration_us(self):
+        return self.reference_time_us[-1]
+
+    @property
+    def avg_duration_of_sample_us(self):
+        # of a grid step, if resampled
+        return self.duration_us / len(self.period)
+
+    @property
+    def avg_duration_of_weight_us(self):
+        # of a measured sample: the run spread over what the fit counts
+        return self.duration_us / np.sum(self.weights)
+
+    @property
+    def time_delta(self):
+        # length of a step in (measured) samples, None if not resampled. See damper.dampen
+        if not self.resample_hz:
+            return None
+        return 1000000 / self.resample_hz / (self.duration_us / len(self.reference_time_us))
+
+    @timedProperty
+    def windows(self):
+        # (smoothing window, peak distance) in samples of this run. Per sample latency.py's
+        # own counts (the samples are about a second), by the actual spacing only on a grid.
+        if not self.resample_hz:
+            return windows(latency.NOMINAL_SAMPLE_SPACING_S)
+        return windows(self.avg_duration_of_sample_us / 1000000)
+
+    @timedProperty
+    def uncorrected(self):
+        return Deviation(data.TABLE_FORMAT['period'].normalize(self.period))
+
+    @timedProperty
+    def temp_smooth(self):
+        return self._derived('temp_smooth', lambda: goodSavgolBecauseILookedAtItHard(self.temp, self.windows[0]))
+
+    @timedProperty
+    def period_smooth(self):
+        return self._derived('period_smooth', lambda: goodSavgolBecauseILookedAtItHard(self.period, self.windows[0]))
+
+    @timedProperty
+    def temp_extrema(self):
+        return self._derived('temp_extrema', lambda: getExtrema(self.temp_smooth, self.windows[1]))
+
+    @timedProperty
+    def period_extrema(self):
+        return self._derived('period_extrema', lambda: getExtrema(self.period_smooth, self.windows[1]))
+
+    @timedProperty
+    def phase_latency(self):
+        return phaseLatency(self.temp_smooth, self.period_smooth, self.sample_time_s, self.window,
+                            self.temp_extrema, self.period_extrema)
+
+    @timedProperty
+    def xcorr_latency(self):
+        return crossCorrelationLatency(self.temp, self.period, self.sample_time_s, self.window)
+
+    @property
+    def latency(self):
+        # mean latency of the temperature by the selected engine
+        return self.xcorr_latency if self.engine == 'xcorr' else self.phase_latency[0]
+
+    @timedProperty
+    def sweep_factors(self):
+        return sweepFactors(self.sweep_steps)
+
+    @timedProperty
+    def sweep(self):
+        # the same series the latency of the engine is computed on
+        period = self.period if self.engine == 'xcorr' else self.period_smooth
+        return dampSweep(self.temp, period, self.sample_time_s, self.window, self.sweep_factors[1],
+                         workers=self.workers, engine=self.engine,
+                         period_extrema=self.period_extrema if self.engine == 'extrema' else None,
+                         peak_distance=self.windows[1], time_delta=self.time_delta)
+
+    def sweepCurves(self):
+        # the workers don't send the curves back, so just redo them for display
+        return dampenMany(self.sweep_factors[1], self.temp, self.time_delta)
+
+    @timedProperty
+    def damp_factor(self):
+        if self.fixed_damp_factor is not None:
+            return self.fixed_damp_factor
+        return bestDampFactor(self.sweep)
+
+    @timedProperty
+    def damped_temp(self):
+        return dampen(self.damp_factor, self.temp, self.time_delta)
+
+    @timedProperty
+    def degree(self):
+        if self.fit_degree is not None:
+            return self.fit_degree
+        return fitDegree(self.damped_temp, self.period, self.weights)
+
+    @timedProperty
+    def fit(self):
+        return Fit(self.temp, self.period, self.degree, self.weights)
+
+    @timedProperty
+    def damped_fit(self):
+        return Fit(self.damped_temp, self.period, self.degree, self.weights)
+
+    @timedProperty
+    def stats(self):
+        return Stats(self.fit(self.temp), self.period, self.uncorrected, self.avg_duration_of_weight_us, self.weights)
+
+    @timedProperty
+    def damped_stats(self):
+        return Stats(self.damped_fit(self.damped_temp), self.period, self.uncorrected, self.avg_duration_of_weight_us,
+                     self.weights)
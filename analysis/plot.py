@@ -1,16 +1,14 @@
 #!/usr/bin/python
 
-import matplotlib.pyplot as plt
+import atexit
 import numpy as np
-import pandas as pd
-import sqlite3 as sq
 from argparse import ArgumentParser
 import data # definitions
-from scipy.signal import savgol_filter, argrelextrema, find_peaks
-
-def readSqlite(filename) -> pd.DataFrame:
-    con = sq.connect(f"file:{filename}?mode=ro", uri=True)
-    return pd.read_sql_query("SELECT * from logdata", con)
+import instrument
+import loader
+import archive
+import follow
+import pyramid
 
 parser = ArgumentParser(
             prog='plot.py',
@@ -18,18 +16,91 @@ parser = ArgumentParser(
 
 parser.add_argument('database')
 parser.add_argument('--no-emit-plot', default=True, action='store_false',dest ='emit_plot')
+parser.add_argument('--follow', action='store_true', help='Keep following the database while log.py writes it')
+parser.add_argument('--interval', type=float, default=2.0, help='Refresh interval of --follow [s]')
+parser.add_argument('--points', type=int, default=2048, help='Points per series kept by --follow')
+parser.add_argument('--from', default=None, dest='begin',
+                    help='Only from there: seconds since the start (negative: before the end), or ISO date/time')
+parser.add_argument('--to', default=None, dest='end', help='Only up to there, like --from')
+parser.add_argument('--profile', default=None,
+                    help='Write wall/CPU time and memory per stage there (JSON, Chrome trace format)')
 args = parser.parse_args()
 
-dataframe = readSqlite(args.database)
-print (dataframe)
+if args.profile:
+    profiler = instrument.enable()
+    def writeProfile():
+        profiler.write(args.profile)
+        print (f"\n{profiler.report()}\nProfile in {args.profile}")
+    atexit.register(writeProfile)
+
+with instrument.stage('import matplotlib'):
+    import matplotlib.pyplot as plt
+
+if args.follow:
+    follow.run(args.database, args.interval, args.points)
+    exit()
+
+period_meta = data.TABLE_FORMAT['period']
+estimate_meta = data.TABLE_FORMAT['period_estimate']
+plotted_keys = ['period', 'period_estimate']
+
+def readPlotData(filename, filters = None):
+    # With a time window, the time comes from the stored reference time, so it is
+    # the same as in the whole run
+    keys = plotted_keys + ['reference_time'] if filters else plotted_keys
+    if archive.isFresh(filename):
+        print (f"Using archive {archive.archivePath(filename)}")
+        columns = archive.load(filename, keys, filters, normalize=False)
+        time_us = columns['reference_time'] if filters else np.cumsum(columns['period'])
+        return (time_us / 1000000,
+                period_meta.normalize(columns['period']),
+                estimate_meta.normalize(columns['period_estimate']))
+
+    # Streamed in chunks, keeping only what is plotted in the end.
+    # Projection: only the two columns we need are read at all.
+    num_rows = loader.countRows(filename, filters)
+    print (f"{num_rows} samples in {filename}")
+
+    sample_time_s = np.empty(num_rows)
+    actual_period = np.empty(num_rows)
+    estimate_period = np.empty(num_rows)
+    offset = 0
+    chunks = loader.readChunks(filename, keys, filters, normalize=False)
+    for chunk in (chunks if filters else loader.withSampleTime(chunks)):
+        length = min(len(chunk['period']), num_rows - offset)
+        sample_time_s[offset:offset + length] = (chunk['reference_time'][:length] / 1000000 if filters
+                                                 else chunk['sample_time_s'][:length])
+        actual_period[offset:offset + length] = period_meta.normalize(chunk['period'][:length])
+        estimate_period[offset:offset + length] = estimate_meta.normalize(chunk['period_estimate'][:length])
+        offset += length
+    return sample_time_s[:offset], actual_period[:offset], estimate_period[:offset]
+
+def readPlotPyramids(filename, filters = None):
+    # Pre-computed levels (pyramid.py) if up to date, otherwise built from the full read.
+    # Those are of the whole run, a time window is always read.
+    pyramids = pyramid.openPyramids(filename, plotted_keys) if not filters else None
+    if pyramids is not None:
+        print (f"Using pyramid {pyramid.pyramidPath(filename)}")
+        # time is stored in us, values raw
+        return (1 / 1000000, period_meta.fractional, estimate_meta.fractional,
+                pyramids['period'], pyramids['period_estimate'])
+    sample_time_s, actual_period, estimate_period = readPlotData(filename, filters)
+    return (1, 1, 1, pyramid.Pyramid.build(sample_time_s, actual_period),
+            pyramid.Pyramid.build(sample_time_s, estimate_period))
 
-columns = {}
-for colname, desc in data.TABLE_FORMAT.items():
-    columns[colname] = (desc.normalize(dataframe[desc.name]), desc)
-sample_time_s = np.cumsum(dataframe[data.TABLE_FORMAT['period'].name] / 1000000) # in seconds
+try:
+    time_filters = loader.timeFilters(args.database, args.begin, args.end)
+except loader.NoTimeColumns as e:
+    print (e)
+    exit(1)
+with instrument.stage('read'):
+    time_scale, period_scale, estimate_scale, actual_period, estimate_period = readPlotPyramids(args.database, time_filters)
+if not len(actual_period.t):
+    print ("Nothing in that time window.")
+    exit(1)
 
 cols = 1
-rows = len(columns) - 1 # without period
+rows = len(data.TABLE_FORMAT) - 1 # without period
 first_axis = None
 i = rows
 # for name, (column, coldesc) in columns.items():
@@ -52,25 +123,30 @@ i = rows
 
 ## --------------------
 
-actual_period = columns['period'][0]
-estimate_period = columns['period_estimate'][0]
-initial_diff = actual_period[0] - estimate_period[0]
+initial_diff = actual_period.y[0] * period_scale - estimate_period.y[0] * estimate_scale
 print (f"Initial difference: {initial_diff}")
-estimate_period_norm = estimate_period - initial_diff
 
+# Drawn from the level that fits the visible range, redrawn when zooming
 fig, ax1 = plt.subplots()
 ax1.set_xlabel('Time [s]')
 ax2 = ax1.twinx()
 ax1.set_ylabel('Period per one Cycle [us]')
-ax1.plot(sample_time_s, actual_period, 'green', label="Measured Period")
-ax1.plot(sample_time_s, estimate_period_norm, 'red', label="Estimated Period")
+views = [
+    pyramid.LevelView(ax1, actual_period, pyramid.envelope('green', label="Measured Period"),
+                      time_scale, period_scale),
+    pyramid.LevelView(ax1, estimate_period, pyramid.envelope('red', label="Estimated Period"),
+                      time_scale, estimate_scale, -initial_diff),
+]
 
-ax2.set_ylabel('Difference [us]')
-ax2.plot(sample_time_s, estimate_period_norm, 'teal', label='Difference')
-ax2.fill_between(sample_time_s, estimate_period_norm, 0,
-        color='teal', alpha=.5)
+def difference(ax, t, lo, hi, mean):
+    return ax.plot(t, mean, 'teal', label='Difference') + [ax.fill_between(t, mean, 0, color='teal', alpha=.5)]
+views.append(pyramid.LevelView(ax2, estimate_period, difference, time_scale, estimate_scale, -initial_diff))
+ax1.set_xlim(actual_period.t[0] * time_scale, actual_period.t[-1] * time_scale)
 plt.title("Estimation quality")
 ax1.legend()
 
 ax2.legend()
+if instrument.PROFILER.enabled:
+    with instrument.stage('render'):
+        fig.canvas.draw()
 plt.show()
@@ -0,0 +1,227 @@
+#!/usr/bin/python
+
+import json
+import os
+import numpy as np
+from argparse import ArgumentParser
+
+import data
+import archive
+import instrument
+
+# Min/max/mean pyramid for plotting long runs. Level 0 is the raw series,
+# every level above has BASE times fewer buckets than the one below. Whatever
+# is visible gets drawn from the finest level that has at most a couple of
+# buckets per pixel, so drawing costs pixels, not samples.
+#
+#   2024-01-01_12-00-00_sensor_log.db
+#   2024-01-01_12-00-00_sensor_log.archive/     level 0 (see archive.py)
+#   2024-01-01_12-00-00_sensor_log.pyramid/
+#       meta.json
+#       time_us.npy                             cumulative reference time
+#       <key>-<level>.npy                       LEVEL_DTYPE, raw (not normalized)
+
+BASE = 4
+MIN_BUCKETS = 512       # the coarsest level still has that many
+POINTS_PER_PIXEL = 2
+META_FILE = 'meta.json'
+FORMAT_VERSION = 1
+LEVEL_DTYPE = np.dtype([('t', '<f8'), ('min', '<f8'), ('max', '<f8'), ('mean', '<f8'), ('n', '<u8')])
+
+def _reduce(t, lo, hi, total, n, base):
+    # base neighbours into one, the last bucket may be partial
+    starts = np.arange(0, len(t), base)
+    level = np.empty(len(starts), LEVEL_DTYPE)
+    level['t'] = t[starts]
+    level['min'] = np.minimum.reduceat(lo, starts)
+    level['max'] = np.maximum.reduceat(hi, starts)
+    level['n'] = np.add.reduceat(n, starts)
+    level['mean'] = np.add.reduceat(total, starts) / level['n']
+    return level
+
+def buildLevels(t, y, base = BASE, min_buckets = MIN_BUCKETS):
+    # levels 1..n. Only the first one touches the raw samples.
+    levels = []
+    if len(y) <= min_buckets:
+        return levels
+    y = np.asarray(y)
+    level = _reduce(np.asarray(t), y, y, y.astype(np.float64), np.ones(len(y), np.uint64), base)
+    levels.append(level)
+    while len(level) > min_buckets * base:
+        level = _reduce(level['t'], level['min'], level['max'], level['mean'] * level['n'], level['n'], base)
+        levels.append(level)
+    return levels
+
+
+class Pyramid:
+    def __init__(self, t, y, levels, base = BASE):
+        self.t = t
+        self.y = y
+        self.levels = levels
+        self.base = base
+
+    @classmethod
+    def build(cls, t, y, base = BASE, min_buckets = MIN_BUCKETS):
+        # in memory, e.g. for derived series that are not stored anywhere
+        return cls(t, y, buildLevels(t, y, base, min_buckets), base)
+
+    def _times(self, level):
+        return self.t if level == 0 else self.levels[level - 1]['t']
+
+    def _range(self, level, t0, t1):
+        # bucket indices covering [t0, t1], plus one on each side so lines reach the edges
+        times = self._times(level)
+        begin = max(np.searchsorted(times, t0, side='right') - 1, 0)
+        end = min(np.searchsorted(times, t1, side='right') + 1, len(times))
+        return begin, end
+
+    def pick(self, t0, t1, pixels, points_per_pixel = POINTS_PER_PIXEL):
+        # finest level that still fits the pixels
+        for level in range(len(self.levels) + 1):
+            begin, end = self._range(level, t0, t1)
+            if end - begin <= pixels * points_per_pixel:
+                return level
+        return len(self.levels)
+
+    def view(self, t0, t1, pixels, points_per_pixel = POINTS_PER_PIXEL):
+        # (level, t, min, max, mean) of what is visible between t0 and t1
+        level = self.pick(t0, t1, pixels, points_per_pixel)
+        begin, end = self._range(level, t0, t1)
+        if level == 0:
+            y = np.asarray(self.y[begin:end], dtype=np.float64)
+            return level, np.asarray(self.t[begin:end]), y, y, y
+        buckets = self.levels[level - 1][begin:end]
+        return level, buckets['t'], buckets['min'], buckets['max'], buckets['mean']
+
+
+class LevelView:
+    # Keeps whatever draw(ax, t, lo, hi, mean) returns on the axis, redrawn at
+    # the matching level whenever the visible range changes.
+    # t is shown as t * time_scale, y as y * scale + offset.
+    _updating = False   # for all views: adding artists autoscales, which changes
+                        # xlim, which updates the other views, which autoscale...
+    def __init__(self, ax, pyramid, draw, time_scale = 1.0, scale = 1.0, offset = 0.0):
+        self.ax = ax
+        self.pyramid = pyramid
+        self.draw = draw
+        self.time_scale = time_scale
+        self.scale = scale
+        self.offset = offset
+        self.artists = []
+        self.level = None
+        t = pyramid.t
+        self.update(xlim=(t[0] * time_scale, t[-1] * time_scale) if len(t) else (0, 1))
+        ax.callbacks.connect('xlim_changed', lambda ax: self.update())
+
+    def update(self, xlim = None):
+        if LevelView._updating:
+            return
+        LevelView._updating = True
+        try:
+            with instrument.stage('level view'):
+                self._redraw(xlim)
+        finally:
+            LevelView._updating = False
+
+    def _redraw(self, xlim):
+        t0, t1 = xlim if xlim is not None else self.ax.get_xlim()
+        pixels = max(int(self.ax.bbox.width), 1)
+        self.level, t, lo, hi, mean = self.pyramid.view(t0 / self.time_scale, t1 / self.time_scale, pixels)
+        for artist in self.artists:
+            artist.remove()
+        scaled = [v * self.scale + self.offset for v in (lo, hi, mean)]
+        self.artists = self.draw(self.ax, t * self.time_scale, *scaled)
+        self.ax.figure.canvas.draw_idle()
+
+def envelope(*args, **kwargs):
+    # draw function: the mean as line, the min/max band around it (if there is one)
+    def draw(ax, t, lo, hi, mean):
+        artists = ax.plot(t, mean, *args, **kwargs)
+        # compared by value: the scaling makes copies, and level 0 has lo == hi
+        if not np.array_equal(lo, hi):
+            artists.append(ax.fill_between(t, lo, hi, color=artists[0].get_color(), alpha=.3, linewidth=0))
+        return artists
+    return draw
+
+def plotLevels(ax, t, y, *args, draw = None, **kwargs):
+    # drop-in for ax.plot(t, y, ...) on long series
+    return LevelView(ax, Pyramid.build(t, y), draw or envelope(*args, **kwargs))
+
+
+def pyramidPath(db_filename):
+    return os.path.splitext(db_filename)[0] + '.pyramid'
+
+def readMeta(path):
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def isFresh(db_filename, path = None):
+    meta = readMeta(path or pyramidPath(db_filename))
+    return (meta is not None
+            and meta.get('version') == FORMAT_VERSION
+            and meta.get('source') == archive.sourceFingerprint(db_filename)
+            and archive.isFresh(db_filename))
+
+def export(db_filename, path = None, keys = None):
+    # needs the archive for level 0, so that gets (re-)exported as well
+    if not archive.isFresh(db_filename):
+        archive.export(db_filename)
+    path = path or pyramidPath(db_filename)
+    os.makedirs(path, exist_ok=True)
+    fingerprint = archive.sourceFingerprint(db_filename)
+    keys = list(keys) if keys is not None else list(data.TABLE_FORMAT.keys())
+
+    columns = archive.openArchive(archive.archivePath(db_filename), set(keys) | {'period'})
+    time_us = np.cumsum(columns['period'], dtype=np.uint64)
+    np.save(os.path.join(path, 'time_us.npy'), time_us)
+    num_levels = {}
+    for key in keys:
+        levels = buildLevels(time_us, columns[key])
+        for i, level in enumerate(levels):
+            np.save(os.path.join(path, f'{key}-{i + 1}.npy'), level)
+        num_levels[key] = len(levels)
+
+    meta = {
+        'version': FORMAT_VERSION,
+        'source': fingerprint,
+        'base': BASE,
+        'levels': num_levels,
+    }
+    # meta last, same as the archive
+    with open(os.path.join(path, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+def openPyramids(db_filename, keys):
+    # {key: Pyramid}, everything memory mapped. None if not up to date.
+    path = pyramidPath(db_filename)
+    if not isFresh(db_filename, path):
+        return None
+    meta = readMeta(path)
+    if not all(key in meta['levels'] for key in keys):
+        return None
+    raw = archive.openArchive(archive.archivePath(db_filename), keys)
+    time_us = np.load(os.path.join(path, 'time_us.npy'), mmap_mode='r')
+    return {key: Pyramid(time_us, raw[key],
+                         [np.load(os.path.join(path, f'{key}-{i + 1}.npy'), mmap_mode='r')
+                          for i in range(meta['levels'][key])],
+                         meta['base'])
+            for key in keys}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='pyramid.py',
+                description='Precomputes min/max/mean levels of sensor log databases for plotting')
+    parser.add_argument('database', nargs='+')
+    parser.add_argument('--force', action='store_true', help='Export even if the pyramid is up to date')
+    args = parser.parse_args()
+
+    for db_filename in args.database:
+        if not args.force and isFresh(db_filename):
+            print (f"{pyramidPath(db_filename)} is up to date")
+            continue
+        print (f"Exporting {db_filename} -> {export(db_filename)}")
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+
+import os
+import re
+import numpy as np
+from argparse import ArgumentParser
+
+import archive
+from damper import Damper
+
+# Replays a recorded run through the firmware's estimation, for any number of
+# (polynom, damp factor) sets at once. Same arithmetic as main.cpp:
+#
+#   tempDamp.consumeNextCycle(temperature)                  Damper, estimator.hpp
+#   estimatedPeriod_us = estimator.estimate(tempDamp.getEstimate())    Horner
+#   estimatedElapsedTime_us += llround(estimatedPeriod_us)
+#
+# and compares the elapsed time with the reference clock (cumsum of period),
+# so we see the drift a config.hpp would have had without flashing anything.
+#
+# Sets with the same damp factor share one damped curve, the polynoms are
+# evaluated for all sets of a group at once, chunk by chunk.
+
+CONFIG_HPP = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'include', 'config.hpp')
+DEFAULT_CHUNK_ROWS = 1 << 12
+SETS_PER_BLOCK = 64    # with the chunk above: 2 MB per array, stays in cache
+_NUMBER = r'[+-]?\s*(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+
+def _constant(source, name, default):
+    match = re.search(name + r'\s*\{\s*(' + _NUMBER + r')\s*\}', source)
+    return float(match.group(1).replace(' ', '')) if match else default
+
+def readConfig(filename = CONFIG_HPP):
+    # (temperatureCalibrationPolynom, dampFactor, center, scale) as the compiler sees them.
+    # Elements are split at commas, so a missing comma adds up two terms, same as in C++.
+    with open(filename) as f:
+        source = re.sub(r'//[^\n]*|/\*.*?\*/', '', f.read(), flags=re.DOTALL)
+    polynom = re.search(r'temperatureCalibrationPolynom\s*\{([^}]*)\}', source).group(1)
+    elements = [e for e in polynom.split(',') if e.strip()]
+    coefficients = [sum(float(n.replace(' ', '')) for n in re.findall(_NUMBER, e)) for e in elements]
+    return (np.array(coefficients), _constant(source, 'dampFactor', None),
+            _constant(source, 'temperatureCalibrationCenter', 0.0), _constant(source, 'temperatureCalibrationScale', 1.0))
+
+def estimate(polynoms, damped, center = 0.0, scale = 1.0):
+    # CompensationEstimator::estimate for every set (rows of polynoms in u, lowest order first).
+    # Horner in the firmware's order, so the rounding is the same, too.
+    polynoms = np.asarray(polynoms, dtype=np.float64)
+    u = (np.asarray(damped, dtype=np.float64) - center) / scale
+    ret = np.repeat(polynoms[:, -1:], len(u), axis=1)
+    for i in range(polynoms.shape[1] - 2, -1, -1):
+        ret *= u
+        ret += polynoms[:, i:i+1]
+    return ret
+
+def llround(xs):
+    # half away from zero (astype truncates). Exact for |x| >= .5, which any period is:
+    # adding .5 only rounds where the spacing of doubles is > .5, and that is integers anyway.
+    # Below, 0.49999999999999994 would become 1.
+    return (xs + np.copysign(.5, xs)).astype(np.int64)
+
+
+class ReplayResult:
+    def __init__(self, num_sets, keep):
+        self.count = 0
+        self.final_error_us = np.zeros(num_sets, dtype=np.int64)
+        self.max_abs_error_us = np.zeros(num_sets, dtype=np.int64)
+        self.duration_us = 0
+        # full series only if asked for, that's sets x samples
+        self.temperature_damped = [] if keep else None
+        self.period_estimate = [] if keep else None
+        self.time_estimate = [] if keep else None
+
+    def _finish(self):
+        if self.time_estimate is not None:
+            for name in ('temperature_damped', 'period_estimate', 'time_estimate'):
+                parts = getattr(self, name)
+                setattr(self, name, np.concatenate(parts, axis=1) if parts else None)
+        return self
+
+    def driftPerDay(self):
+        # s / day, if the drift keeps going like in this run
+        return self.final_error_us / self.duration_us * 24 * 60 * 60
+
+def replay(temperature, period, polynoms, damp_factors, initial_estimate = None, initial_time_us = 0,
+           keep = False, chunk_rows = DEFAULT_CHUNK_ROWS, center = 0.0, scale = 1.0) -> ReplayResult:
+    # temperature, period: raw columns. polynoms: sets x coefficients, damp_factors: one per set.
+    # center, scale: see temperatureCalibrationCenter/-Scale, the same for all sets.
+    # initial_*: state after the sample before the first one given (None: fresh from boot)
+    polynoms = np.atleast_2d(np.asarray(polynoms, dtype=np.float64))
+    damp_factors = np.broadcast_to(np.asarray(damp_factors, dtype=np.float64), (len(polynoms),))
+    factors, group_of = np.unique(damp_factors, return_inverse=True)
+    groups = [np.flatnonzero(group_of == g) for g in range(len(factors))]
+    dampers = []
+    for factor in factors:
+        damper = Damper(factor)
+        damper.estimate = initial_estimate
+        dampers.append(damper)
+
+    result = ReplayResult(len(polynoms), keep)
+    elapsed = np.full(len(polynoms), initial_time_us, dtype=np.int64)
+    reference = np.int64(initial_time_us)
+    for offset in range(0, len(period), chunk_rows):
+        temp_chunk = temperature[offset:offset + chunk_rows]
+        reference_time = reference + np.cumsum(period[offset:offset + chunk_rows], dtype=np.int64)
+        reference = reference_time[-1]
+        if keep:
+            parts = {name: np.empty((len(polynoms), len(temp_chunk)))
+                     for name in ('temperature_damped', 'period_estimate')}
+            parts['time_estimate'] = np.empty((len(polynoms), len(temp_chunk)), dtype=np.int64)
+        for damper, group in zip(dampers, groups):
+            damped = damper.consume(temp_chunk)
+            for block in range(0, len(group), SETS_PER_BLOCK):
+                sets = group[block:block + SETS_PER_BLOCK]
+                estimated_period = estimate(polynoms[sets], damped, center, scale)
+                time_estimate = np.cumsum(llround(estimated_period), axis=1)
+                time_estimate += elapsed[sets, None]
+                elapsed[sets] = time_estimate[:, -1]
+                error = np.abs(time_estimate - reference_time).max(axis=1)
+                result.max_abs_error_us[sets] = np.maximum(result.max_abs_error_us[sets], error)
+                if keep:
+                    parts['temperature_damped'][sets] = damped
+                    parts['period_estimate'][sets] = estimated_period
+                    parts['time_estimate'][sets] = time_estimate
+        if keep:
+            for name, part in parts.items():
+                getattr(result, name).append(part)
+        result.count += len(temp_chunk)
+
+    result.final_error_us = elapsed - reference
+    result.duration_us = int(reference - initial_time_us)
+    return result._finish()
+
+
+def replayLog(columns, polynom, damp_factor, center = 0.0, scale = 1.0, keep = True):
+    # Picks up where the firmware was at the first logged row (the logger
+    # might have started later than the Pico) and replays the rest.
+    return replay(columns['temperature'][1:], columns['period'][1:], [polynom], [damp_factor],
+                  initial_estimate=float(columns['temperature_damped'][0]),
+                  initial_time_us=int(columns['time_estimate'][0]), keep=keep, center=center, scale=scale)
+
+def compareWithLog(columns, result):
+    # {column: (max abs difference, first row that differs)} of a one-set replayLog()
+    # temperature_damped comes as %f (CSV) or float32 (binary telemetry), so that gets a tolerance
+    tolerances = {'temperature_damped': 1e-3, 'period_estimate': 1e-3, 'time_estimate': 0}
+    ret = {}
+    for key, tolerance in tolerances.items():
+        logged = np.asarray(columns[key][1:], dtype=np.float64)
+        difference = np.abs(getattr(result, key)[0] - logged)
+        bad = np.flatnonzero(difference > tolerance)
+        ret[key] = (difference.max() if len(difference) else 0, int(bad[0]) + 1 if len(bad) else None)
+    return ret
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+                prog='replay.py',
+                description='Replays a sensor log through the firmware estimation with other parameters')
+    parser.add_argument('database')
+    parser.add_argument('--config', default=CONFIG_HPP, help='Parameters of the logged run')
+    parser.add_argument('--check', action='store_true',
+                        help='Replay with --config and compare with the estimate columns the firmware logged')
+    parser.add_argument('--polynom', type=lambda s: [float(c) for c in s.split(',')], action='append',
+                        help='Coefficients, lowest order first, comma separated (--polynom=987958,1.5,-4e-5). '
+                             'Repeat for more sets (default: from --config)')
+    parser.add_argument('--damp-factor', type=float, nargs='+', help='Each is combined with every polynom')
+    parser.add_argument('--center', type=float, default=None, help='Of the polynoms (default: from --config)')
+    parser.add_argument('--scale', type=float, default=None, help='Of the polynoms (default: from --config)')
+    args = parser.parse_args()
+
+    config_polynom, config_damp_factor, config_center, config_scale = readConfig(args.config)
+    center = args.center if args.center is not None else config_center
+    scale = args.scale if args.scale is not None else config_scale
+    columns = archive.load(args.database, ['period', 'temperature', 'temperature_damped',
+                                           'period_estimate', 'time_estimate'], normalize=False)
+    print (f"{len(columns['period'])} samples, config: {config_polynom} (center {config_center}, scale {config_scale}) / {config_damp_factor}")
+
+    if args.check:
+        result = replayLog(columns, config_polynom, config_damp_factor, config_center, config_scale)
+        for key, (max_difference, first_bad) in compareWithLog(columns, result).items():
+            print (f"  {key:>18}: max. difference {max_difference}" +
+                   (f", first mismatch in row {first_bad}" if first_bad is not None else ", matches"))
+        exit()
+
+    polynoms = args.polynom or [list(config_polynom)]
+    factors = args.damp_factor or [config_damp_factor]
+    order = max(len(p) for p in polynoms)
+    sets = [(p + [0] * (order - len(p)), f) for p in polynoms for f in factors]
+    result = replay(columns['temperature'], columns['period'], [p for p, _ in sets], [f for _, f in sets],
+                    center=center, scale=scale)
+
+    print (f"{'damp factor':>22}  {'final error [s]':>16}  {'max. error [s]':>16}  {'drift [s/day]':>14}  polynom")
+    for i in np.argsort(np.abs(result.final_error_us)):
+        polynom, factor = sets[i]
+        print (f"{factor:>22}  {result.final_error_us[i] / 1e6:>16.6f}  {result.max_abs_error_us[i] / 1e6:>16.6f}  "
+               f"{result.driftPerDay()[i]:>14.6f}  {polynom}")
@@ -0,0 +1,36 @@
+import numpy as np
+
+# The run on a uniform time grid instead of one value per sample. Samples are
+# as long as the fork takes for periodsPerMeasurement periods, so the sample
+# rate depends on the fork and the config. On a grid it doesn't, and a slow
+# grid (the temperature doesn't do anything interesting in a second anyway)
+# is a lot less to smooth, search and fit.
+#
+# Every grid step is the mean of the samples whose middle falls into it, by
+# the reference time (cumsum of the period). Only the measured ones, if there
+# are any, otherwise what the cleaning made up. Steps without any sample (a
+# gap with --cleaning mask, or a grid finer than the samples) are interpolated.
+# Weights: the number of measured samples per step, the mean of n samples is
+# that much more certain (fitting.py takes them as 1/sigma^2).
+
+def gridIndex(sample_time_us, period, step_us):
+    # step of each sample, by its middle
+    return ((np.asarray(sample_time_us) - np.asarray(period) / 2) // step_us).astype(np.int64)
+
+def resample(columns, sample_time_us, step_us, measured = None):
+    # -> (columns on the grid, weights, grid time in us: the middle of each step)
+    index = gridIndex(sample_time_us, columns['period'], step_us)
+    num_steps = int(index[-1]) + 1 if len(index) else 0
+    is_measured = np.ones(len(index)) if measured is None else np.asarray(measured, dtype=np.float64)
+    weights = np.bincount(index, weights=is_measured, minlength=num_steps)
+    # per sample: does it count for its step's mean?
+    counts = np.where(weights[index] > 0, is_measured, 1.)
+    totals = np.bincount(index, weights=counts, minlength=num_steps)
+    filled = totals > 0
+    grid_time_us = (np.arange(num_steps) + .5) * step_us
+
+    ret = {}
+    for key, values in columns.items():
+        means = np.bincount(index, weights=np.asarray(values) * counts, minlength=num_steps)[filled] / totals[filled]
+        ret[key] = means if filled.all() else np.interp(grid_time_us, grid_time_us[filled], means)
+    return ret, weights, grid_time_us
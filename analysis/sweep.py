@@ -0,0 +1,175 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import brentq
+
+from damper import dampen, dampenMany
+from latency import getExtrema, getPhaseLatency, getPhaseLatencyMany
+from xcorr import CrossCorrelator
+
+# Damp-factor sweep: a coarse pass over candidate factors to find sign changes
+# of the avg. phase latency (damped temperature vs. period), then each bracket
+# is refined with Brent's method. Both run in a worker pool.
+# The latency comes from matched extrema (latency.py) or from the
+# cross-correlation (xcorr.py), see ENGINES.
+#
+# The latency is a step function of the factor (extrema and lags move by whole
+# samples), so Brent can't do better than bisecting it. No point in going
+# finer than a fraction of the bracket then: REFINE_RTOL of its width is five
+# halvings, on top of the coarse pass that already has both ends.
+
+ENGINES = ('extrema', 'xcorr')
+REFINE_RTOL = 1 / 32
+
+# Per-worker reference data. Set once by the pool initializer so that
+# the (big) arrays are not pickled again for every single factor.
+_temp = None
+_period = None
+_sample_time_s = None
+_window = None
+_period_extrema = None
+_correlator = None
+_peak_distance = None
+_time_delta = None
+
+def _initWorker(temp, period, sample_time_s, window, period_extrema, engine = 'extrema',
+                peak_distance = None, time_delta = None):
+    global _temp, _period, _sample_time_s, _window, _period_extrema, _correlator, _peak_distance, _time_delta
+    _temp = np.asarray(temp)
+    _period = np.asarray(period)
+    _sample_time_s = np.asarray(sample_time_s)
+    _window = window
+    _peak_distance = peak_distance
+    _time_delta = time_delta
+    # the reference never changes, so search its extrema (or transform it) once for all factors
+    if engine == 'xcorr':
+        _correlator = CrossCorrelator(_period, _sample_time_s, _window)
+    else:
+        _period_extrema = period_extrema if period_extrema is not None else getExtrema(_period, _peak_distance)
+
+def _latencyForFactor(factor):
+    damped_curve = dampen(factor, _temp, _time_delta)
+    if _correlator is not None:
+        return _correlator.lags(damped_curve)[0]
+    return getPhaseLatency(damped_curve, _period, _sample_time_s, _window,
+                           right_extrema=_period_extrema, distance=_peak_distance)[0]
+
+def _latencyForFactors(factors):
+    # a batch of factors: the period extrema are only searched once
+    damped_curves = dampenMany(factors, _temp, _time_delta)
+    if _correlator is not None:
+        return list(_correlator.lags(damped_curves))
+    return [latency for latency, _, _, _ in
+            getPhaseLatencyMany(damped_curves, _period, _sample_time_s, _window,
+                                right_extrema=_period_extrema, distance=_peak_distance)]
+
+class _CountingLatency:
+    # known: {factor: latency} of the coarse pass, those don't count again
+    def __init__(self, known = None):
+        self.known = dict(known or {})
+        self.evaluations = 0
+
+    def __call__(self, factor):
+        if factor in self.known:
+            return self.known[factor]
+        self.evaluations += 1
+        return _latencyForFactor(factor)
+
+def _refineBracket(lo, hi, latency_lo, latency_hi, rtol):
+    latency = _CountingLatency({lo: latency_lo, hi: latency_hi})
+    root = brentq(latency, lo, hi, xtol=(hi - lo) * rtol)
+    return root, latency.evaluations
+
+
+class Bracket:
+    def __init__(self, lo, hi, latency_lo, latency_hi):
+        self.lo = lo
+        self.hi = hi
+        self.latency_lo = latency_lo
+        self.latency_hi = latency_hi
+        self.root = lo if latency_lo == 0 else None
+        self.evaluations = 0
+
+    def isExact(self) -> bool:
+        return self.latency_lo == 0
+
+    def __str__(self):
+        return f"[{self.lo}, {self.hi}] ({self.latency_lo}s .. {self.latency_hi}s) -> {self.root}"
+
+
+def findBrackets(factors, latencies):
+    brackets = []
+    for i in range(len(factors)):
+        if np.isnan(latencies[i]):
+            continue
+        if latencies[i] == 0:
+            brackets.append(Bracket(factors[i], factors[i], latencies[i], latencies[i]))
+            continue
+        if i + 1 >= len(factors) or np.isnan(latencies[i + 1]) or latencies[i + 1] == 0:
+            continue
+        if np.signbit(latencies[i]) != np.signbit(latencies[i + 1]):
+            brackets.append(Bracket(factors[i], factors[i + 1], latencies[i], latencies[i + 1]))
+    return brackets
+
+
+class SweepResult:
+    def __init__(self, factors, latencies, brackets):
+        self.factors = factors
+        self.latencies = latencies
+        self.brackets = brackets
+
+    @property
+    def roots(self):
+        return [b.root for b in self.brackets if b.root is not None]
+
+    @property
+    def evaluations(self):
+        return len(self.factors) + sum(b.evaluations for b in self.brackets)
+
+
+class _InlineExecutor:
+    # Same interface as the pool, for workers=1 (and debugging)
+    def __init__(self, initializer, initargs):
+        initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def map(self, fn, *iterables):
+        return map(fn, *iterables)
+
+
+def sweep(temp, period, sample_time_s, window, factors, workers = None, rtol = REFINE_RTOL,
+          period_extrema = None, engine = 'extrema', peak_distance = None, time_delta = None):
+    # period: smoothed for 'extrema', raw for 'xcorr' (it needs no smoothing, see pipeline.crossCorrelationLatency).
+    # rtol: of the bracket width, see REFINE_RTOL. peak_distance: in samples, see latency.windowSamples.
+    # time_delta: see damper.dampen
+    assert engine in ENGINES
+    factors = list(factors)
+    initargs = (temp, period, sample_time_s, window, period_extrema, engine, peak_distance, time_delta)
+    if workers == 1:
+        executor = _InlineExecutor(_initWorker, initargs)
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=initargs)
+
+    with executor as pool:
+        # one batch of factors per worker
+        num_batches = min(len(factors), workers or os.cpu_count() or 1)
+        batches = [list(b) for b in np.array_split(factors, num_batches)] if factors else []
+        latencies = [latency for batch in pool.map(_latencyForFactors, batches) for latency in batch]
+        brackets = findBrackets(factors, latencies)
+        to_refine = [b for b in brackets if not b.isExact()]
+        refined = pool.map(_refineBracket,
+                           [b.lo for b in to_refine],
+                           [b.hi for b in to_refine],
+                           [b.latency_lo for b in to_refine],
+                           [b.latency_hi for b in to_refine],
+                           [rtol] * len(to_refine))
+        for bracket, (root, evaluations) in zip(to_refine, refined):
+            bracket.root = root
+            bracket.evaluations = evaluations
+
+    return SweepResult(factors, latencies, brackets)
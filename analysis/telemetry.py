@@ -0,0 +1,112 @@
+import numpy as np
+
+import data
+
+# Decoder for the binary telemetry frames (src/telemetry.hpp).
+# Frame: sync (A5 5A) | sequence u16 | TABLE_FORMAT columns as ColDesc.wire | crc16
+# The CRC covers sequence and columns.
+
+SYNC_WORD = 0x5AA5
+SYNC_BYTES = SYNC_WORD.to_bytes(2, 'little')
+
+FRAME_DTYPE = np.dtype(
+    [('sync', '<u2'), ('sequence', '<u2')] +
+    [(key, desc.wire) for key, desc in data.TABLE_FORMAT.items()] +
+    [('crc', '<u2')])
+FRAME_SIZE = FRAME_DTYPE.itemsize
+
+_CRC_BEGIN = FRAME_DTYPE.fields['sequence'][1]
+_CRC_END = FRAME_DTYPE.fields['crc'][1]
+
+def _crcTable():
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+        table[byte] = crc & 0xFFFF
+    return table
+
+_CRC_TABLE = _crcTable()
+
+def crc16(frames_bytes):
+    # CRC-16/CCITT-FALSE over the rows of a (num_frames, length) uint8 array.
+    # Iterates over the byte positions only, all frames at once.
+    frames_bytes = np.atleast_2d(frames_bytes)
+    crc = np.full(len(frames_bytes), 0xFFFF, dtype=np.uint16)
+    for column in frames_bytes.T:
+        index = ((crc >> 8) ^ column) & 0xFF
+        crc = (crc << 8) ^ _CRC_TABLE[index]
+    return crc
+
+def decode(buffer):
+    # Returns (frames, consumed_bytes, num_corrupted).
+    # Everything before `consumed_bytes` is either decoded or garbage;
+    # the rest may be the beginning of a frame that is not complete yet.
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    if len(raw) < FRAME_SIZE:
+        return np.empty(0, dtype=FRAME_DTYPE), 0, 0
+
+    last_start = len(raw) - FRAME_SIZE
+    candidates = np.flatnonzero((raw[:last_start + 1] == SYNC_BYTES[0]) &
+                                (raw[1:last_start + 2] == SYNC_BYTES[1]))
+    frames_bytes = raw[candidates[:, None] + np.arange(FRAME_SIZE)]
+    frames = frames_bytes.view(FRAME_DTYPE).reshape(-1)
+    valid = crc16(frames_bytes[:, _CRC_BEGIN:_CRC_END]) == frames['crc']
+
+    # A sync word inside a valid frame is payload, not a frame start
+    starts = candidates[valid]
+    if len(starts) > 1:
+        keep = np.ones(len(starts), dtype=bool)
+        keep[1:] = np.diff(starts) >= FRAME_SIZE
+        starts = starts[keep]
+        valid_indices = np.flatnonzero(valid)[keep]
+    else:
+        valid_indices = np.flatnonzero(valid)
+
+    if len(starts):
+        consumed = starts[-1] + FRAME_SIZE
+    else:
+        # keep the tail, it could be the start of the next frame
+        consumed = last_start + 1
+    # candidates that failed the CRC and are not inside a good frame
+    in_good_frame = np.zeros(len(candidates), dtype=bool)
+    if len(starts):
+        frame_of = np.searchsorted(starts, candidates, side='right') - 1
+        in_good_frame = (frame_of >= 0) & (candidates < starts[np.maximum(frame_of, 0)] + FRAME_SIZE)
+    num_corrupted = int(np.count_nonzero(~valid & ~in_good_frame & (candidates < consumed)))
+    return frames[valid_indices].copy(), int(consumed), num_corrupted
+
+def lostFrames(sequences, previous = None):
+    # Number of frames missing according to the (wrapping) sequence numbers
+    sequences = np.asarray(sequences, dtype=np.int64)
+    if previous is not None:
+        sequences = np.concatenate(([previous], sequences))
+    if len(sequences) < 2:
+        return 0
+    steps = np.diff(sequences) % (1 << 16)
+    return int(np.sum(steps[steps > 0] - 1))
+
+def toRows(frames):
+    # In TABLE_FORMAT order, ready for an INSERT
+    return frames[list(data.TABLE_FORMAT.keys())].tolist()
+
+
+class FrameDecoder:
+    def __init__(self):
+        self.pending = b''
+        self.last_sequence = None
+        self.decoded = 0
+        self.lost = 0
+        self.corrupted = 0
+
+    def feed(self, chunk):
+        buffer = self.pending + chunk
+        frames, consumed, corrupted = decode(buffer)
+        self.pending = buffer[consumed:]
+        self.corrupted += corrupted
+        if len(frames):
+            self.lost += lostFrames(frames['sequence'], self.last_sequence)
+            self.last_sequence = int(frames['sequence'][-1])
+            self.decoded += len(frames)
+        return frames
@@ -0,0 +1,48 @@
+import numpy as np
+from numpy.testing import assert_allclose
+
+from damper import Damper, dampen, dampenMany
+
+# The lfilter damper against the per-sample loop estimate.py had before
+# (and the firmware has): y = y + (x - y) * factor, starting at the first sample.
+
+FACTORS = [0.001, 0.0023, 0.01, 0.3, 1.0]
+
+def loopDampen(factor, xs):
+    rolling_value = xs[0]
+    ret = []
+    for x in xs:
+        rolling_value += (x - rolling_value) * factor
+        ret.append(rolling_value)
+    return np.array(ret)
+
+def randomTemperature(num_samples = 20000, seed = 1):
+    # raw centidegrees: a slow wander plus sensor noise
+    rng = np.random.default_rng(seed)
+    return (2200 + np.cumsum(rng.normal(0, 2, num_samples)) + rng.normal(0, 5, num_samples)).astype(np.int64)
+
+def test_dampen_matches_loop():
+    xs = randomTemperature()
+    for factor in FACTORS:
+        assert_allclose(dampen(factor, xs), loopDampen(factor, xs), rtol=1e-12, atol=1e-9)
+
+def test_dampenMany_matches_loop():
+    xs = randomTemperature(seed=2)
+    damped = dampenMany(FACTORS, xs)
+    assert damped.shape == (len(FACTORS), len(xs))
+    for row, factor in zip(damped, FACTORS):
+        assert_allclose(row, loopDampen(factor, xs), rtol=1e-12, atol=1e-9)
+
+def test_consume_in_chunks_matches_loop():
+    xs = randomTemperature(seed=3)
+    rng = np.random.default_rng(4)
+    for factor in FACTORS:
+        # uneven chunks, including single samples and empty ones
+        splits = np.sort(np.concatenate((rng.integers(0, len(xs), 20), [0, 1, 1, 2, len(xs) - 1])))
+        damper = Damper(factor)
+        chunks = [damper.consume(chunk) for chunk in np.split(xs, splits)]
+        assert_allclose(np.concatenate(chunks), loopDampen(factor, xs), rtol=1e-12, atol=1e-9)
+
+def test_one_sample_steps_are_samples():
+    xs = randomTemperature(1000, seed=5)
+    assert_allclose(dampen(0.01, xs, 1), dampen(0.01, xs))
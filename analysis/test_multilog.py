@@ -0,0 +1,94 @@
+import asyncio
+import os
+import pty
+import sqlite3
+import time
+import numpy as np
+
+import data
+import ingest
+import multilog
+
+# multilog.py against pseudo terminals, like against the forks: every device
+# sends its CSV lines, the rows have to end up with the right device and the
+# right reference time (cumulative Period, per device), per device, shared and
+# split up again.
+
+NUM_LINES = 300
+DEVICE_IDS = ('fork_a', 'fork_b')
+TIMEOUT_S = 10
+
+def periods(index):
+    # different per device, so rows that went to the wrong one show up in the sums
+    return 1000000 + 1000 * index + np.arange(NUM_LINES) % 7
+
+def lines(index):
+    return "".join(f"{period},{2000 + k},3,4,5.0,6.5,{k},{index}\r\n"
+                   for k, period in enumerate(periods(index))).encode()
+
+def countRows(filenames):
+    total = 0
+    for filename in filenames:
+        db = sqlite3.connect(filename)
+        total += db.execute(f"SELECT COUNT(*) FROM {data.TABLE_NAME}").fetchone()[0]
+        db.close()
+    return total
+
+async def logOverPtys(writers, filenames):
+    pairs = [pty.openpty() for _ in DEVICE_IDS]
+    devices = {device_id: os.ttyname(slave) for device_id, (_, slave) in zip(DEVICE_IDS, pairs)}
+    task = asyncio.create_task(multilog.logDevices(devices, writers, flush_interval_s=.1))
+    # opening the port flushes its input, so only send once it's open
+    await asyncio.sleep(.5)
+    for index, (master, slave) in enumerate(pairs):
+        os.close(slave)
+        os.write(master, lines(index))
+    deadline = time.monotonic() + TIMEOUT_S
+    while countRows(filenames) < NUM_LINES * len(DEVICE_IDS) and time.monotonic() < deadline:
+        await asyncio.sleep(.1)
+    # hang up, that ends the readers
+    for master, _ in pairs:
+        os.close(master)
+    readers = await asyncio.wait_for(task, TIMEOUT_S)
+    for db in {w.db for w in writers.values()}:
+        db.commit()
+        db.close()
+    return readers
+
+def readDevice(filename, device_id = None):
+    db = sqlite3.connect(filename)
+    where = f" WHERE \"{ingest.DEVICE_COLUMN}\" = ?" if device_id is not None else ""
+    rows = db.execute(f"SELECT \"{data.TABLE_FORMAT['period'].name}\", \"{data.TABLE_FORMAT['estimate_diff'].name}\", "
+                      f"\"{data.TIME_COLUMNS['reference_time'].name}\" FROM {data.TABLE_NAME}{where} ORDER BY rowid",
+                      () if device_id is None else (device_id,)).fetchall()
+    db.close()
+    return np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+def checkDevice(rows, index):
+    period, sent_by, reference_time = rows.T
+    np.testing.assert_array_equal(period, periods(index))
+    np.testing.assert_array_equal(sent_by, index)
+    np.testing.assert_array_equal(reference_time, np.cumsum(periods(index)))
+
+def test_per_device(tmp_path):
+    writers, filenames = multilog.openWriters(DEVICE_IDS, prefix=str(tmp_path / 'run'), batch_size=16,
+                                              flush_interval_s=.1)
+    readers = asyncio.run(logOverPtys(writers, filenames))
+    assert [r.received for r in readers] == [NUM_LINES] * len(DEVICE_IDS)
+    assert filenames == [str(tmp_path / f'run_{d}_sensor_log.db') for d in DEVICE_IDS]
+    for index, filename in enumerate(filenames):
+        checkDevice(readDevice(filename), index)
+
+def test_shared_and_split(tmp_path):
+    shared = str(tmp_path / 'run_multi_sensor_log.db')
+    writers, filenames = multilog.openWriters(DEVICE_IDS, shared, batch_size=16, flush_interval_s=.1)
+    asyncio.run(logOverPtys(writers, filenames))
+    assert filenames == [shared]
+    for index, device_id in enumerate(DEVICE_IDS):
+        checkDevice(readDevice(shared, device_id), index)
+
+    parts = multilog.splitDatabase(shared)
+    assert sorted(parts) == sorted(str(tmp_path / f'run_{d}_sensor_log.db') for d in DEVICE_IDS)
+    for part in parts:
+        index = DEVICE_IDS.index(os.path.basename(part).removeprefix('run_').removesuffix('_sensor_log.db'))
+        checkDevice(readDevice(part), index)
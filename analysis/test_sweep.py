@@ -0,0 +1,32 @@
+import pytest
+
+import bench
+import pipeline
+import sweep
+
+# The sweep on a synthetic run (bench.py): fewer phase latency evaluations than
+# the fixed grid estimate.py had, and still where a much finer refinement ends up.
+
+BASELINE_EVALUATIONS = 15   # the old grid: one per factor, then interpolated
+NUM_ROWS = 20000
+
+@pytest.fixture(scope='module')
+def database(tmp_path_factory):
+    return bench.syntheticDatabase(str(tmp_path_factory.mktemp('sweep')), NUM_ROWS)
+
+def sweepOf(run, rtol):
+    period = run.period if run.engine == 'xcorr' else run.period_smooth
+    return sweep.sweep(run.temp, period, run.sample_time_s, run.window, run.sweep_factors[1], workers=1, rtol=rtol,
+                       period_extrema=run.period_extrema if run.engine == 'extrema' else None,
+                       engine=run.engine, peak_distance=run.windows[1])
+
+@pytest.mark.parametrize('engine', sweep.ENGINES)
+def test_fewer_evaluations_than_the_grid(database, engine):
+    run = pipeline.Run(database, workers=1, use_cache=False, engine=engine)
+    result = run.sweep
+    assert len(result.brackets) == 1
+    assert result.evaluations < BASELINE_EVALUATIONS
+
+    bracket = result.brackets[0]
+    fine = sweepOf(run, 1e-6).brackets[0]
+    assert abs(bracket.root - fine.root) <= (bracket.hi - bracket.lo) * sweep.REFINE_RTOL
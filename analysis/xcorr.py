@@ -0,0 +1,63 @@
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+from scipy.signal import detrend
+
+# Phase latency from the cross-correlation instead of matched extrema: the lag
+# at which the (detrended) period fits the temperature best. O(n log n), no
+# smoothing, no peak distances to tune, and it doesn't care whether the
+# temperature has many extrema or two. Same sign as getPhaseLatency: positive
+# if the period reacts after the temperature.
+#
+# Samples count as equidistant (one period each, that's close enough), so the
+# lag in samples is scaled by the mean sample spacing of sample_time.
+# Expects the period to go up with the temperature, like the extrema matching does.
+
+CANDIDATES_PER_BLOCK = 16   # spectra of that many curves at once
+
+def _parabolicPeak(left, center, right):
+    # offset of the vertex from the center sample, in [-0.5, 0.5] if center is the max
+    denominator = left - 2 * center + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator < 0, .5 * (left - right) / denominator, 0.)
+
+
+class CrossCorrelator:
+    # right (the reference, e.g. the period) is transformed once, lefts in batches
+    def __init__(self, right, sample_time, window):
+        right = detrend(np.asarray(right, dtype=np.float64))
+        self.length = len(right)
+        self.spacing = (sample_time[-1] - sample_time[0]) / max(self.length - 1, 1)
+        self.max_lag = min(int(np.ceil(window / self.spacing)), self.length - 1)
+        # zero padded, no wrap around for lags up to max_lag
+        self.size = next_fast_len(self.length + self.max_lag + 1, real=True)
+        self.right_spectrum = rfft(right, self.size)
+
+    def correlation(self, lefts):
+        # candidates x lags (-max_lag..max_lag), c[k] = mean_n left[n] * right[n + k]
+        lefts = detrend(np.atleast_2d(np.asarray(lefts, dtype=np.float64)), axis=-1)
+        full = irfft(np.conj(rfft(lefts, self.size, axis=-1)) * self.right_spectrum, self.size, axis=-1)
+        c = np.concatenate((full[:, self.size - self.max_lag:], full[:, :self.max_lag + 1]), axis=1)
+        # per overlapping sample: the peaks are broad, fewer terms at larger lags would pull them towards 0
+        return c / (self.length - np.abs(np.arange(-self.max_lag, self.max_lag + 1)))
+
+    def lags(self, lefts):
+        # latency per left curve, in units of sample_time. NaN if the best lag is at the
+        # edge of the window, that's no peak but a slope.
+        lefts = np.atleast_2d(lefts)
+        ret = np.empty(len(lefts))
+        for block in range(0, len(lefts), CANDIDATES_PER_BLOCK):
+            c = self.correlation(lefts[block:block + CANDIDATES_PER_BLOCK])
+            peak = np.argmax(c, axis=1)
+            inside = (peak > 0) & (peak < c.shape[1] - 1)
+            rows = np.arange(len(c))
+            at = np.clip(peak, 1, c.shape[1] - 2)
+            offset = _parabolicPeak(c[rows, at - 1], c[rows, at], c[rows, at + 1])
+            ret[block:block + len(c)] = np.where(inside, (peak + offset - self.max_lag) * self.spacing, np.nan)
+        return ret
+
+
+def getCrossCorrelationLatencyMany(lefts, right, sample_time, window):
+    return CrossCorrelator(right, sample_time, window).lags(lefts)
+
+def getCrossCorrelationLatency(left, right, sample_time, window):
+    return getCrossCorrelationLatencyMany([left], right, sample_time, window)[0]
@@ -23,6 +23,10 @@ static constexpr size_t periodsPerMeasurement = expectedOscFreq;
 
 static constexpr size_t referenceClockFrequency = 1000 * 1000;  // us per count
 
+// Send fixed-size binary frames (see telemetry.hpp) instead of CSV lines.
+// log.py needs `--binary` then.
+static constexpr bool binaryTelemetry = false;
+
 // Count resolution is currently 1 us
 static constexpr
 OscCount
@@ -50,6 +54,12 @@ static constexpr std::array temperatureCalibrationPolynom {
     -4.597156613378032e-05, // "nonlinearity" of temperature dependence
 };
 
+// The polynom above is in u = (T - center) / scale, evaluated with Horner.
+// 0 and 1 for a plain polynom of the (damped) temperature; estimate.py prints
+// all three for a centered and scaled fit, which stays accurate at higher orders.
+static constexpr double temperatureCalibrationCenter {0};
+static constexpr double temperatureCalibrationScale {1};
+
 // This is not calibrated against an actual time difference,
 // but instead was "trained" on the average sample time.
 // FIXME: This value might be too small to actually affect calc
@@ -10,23 +10,30 @@ class CompensationEstimator
 public:
     static constexpr size_t numberOfPolynoms = PolyCount;
 
-    constexpr CompensationEstimator(const std::array<double, PolyCount>& polynoms)
-        : mPolynoms{polynoms}
+    // polynoms are in u = (parameter - center) / scale, lowest order first.
+    // center 0 and scale 1 are the plain polynom (and exactly the same numbers).
+    constexpr CompensationEstimator(const std::array<double, PolyCount>& polynoms,
+                                    const double& center = 0, const double& scale = 1)
+        : mPolynoms{polynoms}, mCenter{center}, mScale{scale}
     {}
 
     constexpr
     double
     estimate(const double& parameter) const
     {
-        double sum = mPolynoms[0];
-        for (size_t i = 1; i < mPolynoms.size(); i++)
+        // Horner: one multiply and add per order, no (software float!) std::pow
+        const double u = (parameter - mCenter) / mScale;
+        double sum = mPolynoms[PolyCount - 1];
+        for (size_t i = PolyCount - 1; i-- > 0;)
         {
-            sum += mPolynoms[i] * std::pow(parameter, i);
+            sum = sum * u + mPolynoms[i];
         }
         return sum;
     }
 private:
     std::array<double, numberOfPolynoms> mPolynoms;
+    double mCenter;
+    double mScale;
 };
 
 
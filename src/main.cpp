@@ -2,6 +2,7 @@
 #include "bme280.hpp"
 #include "led.hpp"
 #include "estimator.hpp"
+#include "telemetry.hpp"
 
 #include <pico/stdlib.h>
 #include <pico/util/queue.h>
@@ -96,8 +97,10 @@ int main() {
     auto lastEnvironmentSample = bme.readEnvironment();
     auto lastValidOscSampleTime = get_absolute_time();
     uint64_t estimatedElapsedTime_us = 0;
-    constexpr CompensationEstimator estimator{temperatureCalibrationPolynom};
+    constexpr CompensationEstimator estimator{temperatureCalibrationPolynom,
+                                             temperatureCalibrationCenter, temperatureCalibrationScale};
     Damper tempDamp{dampFactor};
+    uint16_t frameSequence = 0;
 
     // is here because of no signal not working on the first occurrence dunno
     status.noSignal();
@@ -157,6 +160,25 @@ int main() {
             const double estimatedPeriod_us = estimator.estimate(estimatedTemperature_cdg);
             estimatedElapsedTime_us += llround(estimatedPeriod_us);
 
+            const auto env = lastEnvironmentSample.value_or(BME280::invalidMeasurement);
+            const int64_t differenceToInternalTime_us = time_us_64() - estimatedElapsedTime_us;
+
+            if constexpr (binaryTelemetry)
+            {
+                TelemetryFrame frame{};
+                frame.sequence = frameSequence++;   // wraps, that is fine
+                frame.period = oscCount;
+                frame.temperature_centidegree = env.temperature_centidegree;
+                frame.pressure_q23_8 = env.pressure_q23_8;
+                frame.humidity_q22_10 = env.humidity_q22_10;
+                frame.estimatedTemperature_cdg = estimatedTemperature_cdg;
+                frame.estimatedPeriod_us = estimatedPeriod_us;
+                frame.estimatedElapsedTime_us = estimatedElapsedTime_us;
+                frame.differenceToInternalTime_us = differenceToInternalTime_us;
+                sendFrame(frame);
+                continue;
+            }
+
             if (currentLine >= printHeaderEveryNLines)
             {
                 printCsvHeader();
@@ -165,16 +187,13 @@ int main() {
 
             printf("%lu", oscCount);
 
-            {
-                const auto env = lastEnvironmentSample.value_or(BME280::invalidMeasurement);
-                printf(",%ld,%lu,%lu",
-                    env.temperature_centidegree,
-                    env.pressure_q23_8,
-                    env.humidity_q22_10);
-            }
+            printf(",%ld,%lu,%lu",
+                env.temperature_centidegree,
+                env.pressure_q23_8,
+                env.humidity_q22_10);
 
             printf(",%f,%f,%lld", estimatedTemperature_cdg, estimatedPeriod_us, estimatedElapsedTime_us);
-            printf(",%lld", time_us_64() - estimatedElapsedTime_us);
+            printf(",%lld", differenceToInternalTime_us);
 
             // now the derived values
             // printf(",%f,%ld,%lu,%lu",
@@ -0,0 +1,58 @@
+#pragma once
+
+#include <stddef.h>
+#include <inttypes.h>
+#include <pico/stdio.h>
+
+// Fixed-layout binary alternative to the CSV line.
+// Layout has to match telemetry.FRAME_DTYPE in analysis/telemetry.py!
+// Everything little endian (as is the RP2040).
+struct __attribute__((packed)) TelemetryFrame
+{
+    static constexpr uint16_t syncWord = 0x5AA5;    // on the wire: A5 5A
+
+    uint16_t sync = syncWord;
+    uint16_t sequence;
+    uint32_t period;                    // [us / periodsPerMeasurement]
+    int32_t temperature_centidegree;
+    uint32_t pressure_q23_8;
+    uint32_t humidity_q22_10;
+    float estimatedTemperature_cdg;
+    double estimatedPeriod_us;
+    uint64_t estimatedElapsedTime_us;
+    int64_t differenceToInternalTime_us;
+    uint16_t crc;                       // over everything after sync, up to crc
+};
+static_assert(sizeof(TelemetryFrame) == 50);
+
+// CRC-16/CCITT-FALSE (poly 0x1021, init 0xFFFF)
+static constexpr
+uint16_t
+crc16(const uint8_t* data, size_t length)
+{
+    uint16_t crc = 0xFFFF;
+    for (size_t i = 0; i < length; i++)
+    {
+        crc ^= static_cast<uint16_t>(data[i]) << 8;
+        for (int bit = 0; bit < 8; bit++)
+        {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : (crc << 1);
+        }
+    }
+    return crc;
+}
+
+static inline
+void
+sendFrame(TelemetryFrame& frame)
+{
+    static constexpr size_t crcBegin = offsetof(TelemetryFrame, sequence);
+    static constexpr size_t crcEnd = offsetof(TelemetryFrame, crc);
+    const auto* raw = reinterpret_cast<const uint8_t*>(&frame);
+    frame.crc = crc16(raw + crcBegin, crcEnd - crcBegin);
+    for (size_t i = 0; i < sizeof(TelemetryFrame); i++)
+    {
+        // raw: no CRLF translation for our '\n' bytes
+        putchar_raw(raw[i]);
+    }
+}